@@ -1,12 +1,24 @@
 import math
+import mmap
 import os
-from .multithreading import multithreaded
+from .multithreading import multithreaded, _chunked
+from .bloomfilter import BloomFilter
 from tqdm import tqdm
 from abc import ABC
+from functools import partial
+from collections import OrderedDict
+from threading import Lock
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
 
 import logging
 logger = logging.getLogger(__name__)
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 class Chunk:
     r"""
@@ -157,6 +169,124 @@ def binary_search(alist, item, start=None, stop=None):
     return None
 
 
+def _interpolation_key(value) -> int:
+    if type(value) is int:
+        return value
+    if type(value) is Chunk:
+        value = value.data
+    return int.from_bytes(value, 'big')
+
+
+def interpolation_search(alist, item, min_value=None, max_value=None, key=None):
+    """
+    Interpolation search with binary search fallback: estimates the position from the value of the item, which
+    takes about log(log(n)) probes on uniformly distributed keys (like CRC32s). Whenever an estimate doesn't at
+    shrink the range 8 times in 3 probes, the next probe is a bisection, so it never gets much worse than
+    binary_search on skewed data.
+
+    :param min_value: int Value lower than any item can be (eg. -1 for bytes), saves probing the first item
+    :param max_value: int Value higher than any item can be (eg. 256 ** nbytes for bytes)
+    :param key: callable Maps items to ints, defaults to ints as is and bytes/Chunks as big endian ints
+    :return: int|None
+
+    >>> interpolation_search([], 't') is None
+    True
+    >>> interpolation_search([3, 4, 5], 4)
+    1
+    >>> n = 100
+    >>> [interpolation_search(range(0, n, 3), i) for i in range(0, 10)]
+    [0, None, None, 1, None, None, 2, None, None, 3]
+    >>> all(interpolation_search([i * i for i in range(n)], i * i) == i for i in range(n))
+    True
+    >>> any(interpolation_search(range(0, n), i) is not None for i in range(n, 3*n))
+    False
+    >>> interpolation_search([b'a', b'b', b'z'], b'z', -1, 256)
+    2
+    >>> class Probes(list):
+    ...     probes = 0
+    ...     def __getitem__(self, i):
+    ...         self.probes += 1
+    ...         return super().__getitem__(i)
+    >>> import random
+    >>> values = sorted(random.Random(1).sample(range(2 ** 32), 100000))
+    >>> data = Probes(values)
+    >>> all(interpolation_search(data, values[i], -1, 2 ** 32) == i for i in range(0, 100000, 100))
+    True
+    >>> data.probes / 1000 < 6
+    True
+    >>> skewed = Probes(sorted(set(int(random.Random(1).random() ** 8 * 2 ** 32) for _ in range(100000))))
+    >>> all(interpolation_search(skewed, v, -1, 2 ** 32) is not None for v in list(skewed)[::100])
+    True
+    >>> skewed.probes / len(skewed[::100]) < 25
+    True
+    """
+    n = len(alist)
+    if not n:
+        return None
+    if key is None:
+        key = _interpolation_key
+    k = key(item)
+
+    lo, hi = 0, n - 1
+    if min_value is None:
+        first = key(alist[0])
+        if k <= first:
+            return 0 if k == first else None
+        lo, min_value = 1, first
+    if max_value is None:
+        last = key(alist[-1])
+        if k >= last:
+            return n - 1 if k == last else None
+        hi, max_value = n - 2, last
+    if not min_value < k < max_value:
+        return None
+
+    # invariant: min_value (at lo - 1) < k < max_value (at hi + 1)
+    bisect = False
+    steps, checkpoint = 0, hi - lo + 1
+    while lo <= hi:
+        if bisect:
+            mid = (lo + hi) // 2
+        else:
+            mid = lo - 1 + (k - min_value) * (hi - lo + 2) // (max_value - min_value)
+            mid = min(max(mid, lo), hi)
+        found = key(alist[mid])
+        if found == k:
+            return mid
+        if found < k:
+            lo, min_value = mid + 1, found
+        else:
+            hi, max_value = mid - 1, found
+        bisect = False
+        steps += 1
+        if steps == 3:
+            # estimates aren't converging (skewed data), so bisect once
+            bisect = hi - lo + 1 > checkpoint // 8
+            steps, checkpoint = 0, hi - lo + 1
+    return None
+
+
+def buffer_contains(data, nbytes, length, item):
+    """
+    Binary search straight on a buffer (bytes, mmap) of `length` items of `nbytes`, skips the __getitem__ overhead
+    per probe
+
+    >>> buffer_contains(b'aabbcc', 2, 3, b'bb'), buffer_contains(b'aabbcc', 2, 3, b'bc')
+    (True, False)
+    """
+    start = 0
+    stop = length - 1
+    while start < stop:
+        mid = (stop + start) // 2
+        offset = mid * nbytes
+        if data[offset:offset + nbytes] < item:
+            start = mid + 1
+        else:
+            stop = mid
+    offset = start * nbytes
+    return data[offset:offset + nbytes] == item
+
+
 class EmptySortedBytes:
     def __enter__(self):
         return self
@@ -185,18 +315,35 @@ EmptySortedBytes = EmptySortedBytes()
 
 
 class ASortedBytes(ABC):
+    _interpolation = False
+
     def assert_valid_item(self, item):
         if len(item) != self._nbytes:
             raise KeyError("Expected length of %s" % self._nbytes)
 
     def __contains__(self, item):
         self.assert_valid_item(item)
+        if self._interpolation:
+            return interpolation_search(self, item, -1, 256 ** self._nbytes) is not None
         return binary_search(self, item) is not None
 
+    def _index(self, item) -> int:
+        if type(item) is slice:
+            if item.stop or item.step:
+                raise NotImplementedError("Slice not supported atm")
+            item = item.start
+        if type(item) is not int:
+            raise NotImplementedError("Only supporting integers as item keys")
+        if item < 0:
+            item = self._len + item
+        if item < 0 or item >= self._len:
+            raise IndexError("Index %d out of range" % item)
+        return item
+
     def __enter__(self):
         return self
 
-    def __exit__(self):
+    def __exit__(self, exc_type, exc_val, exc_tb):
         pass
 
 
@@ -204,11 +351,16 @@ class SortedBytesFile(ASortedBytes):
     """
     Reads the 32-bit int files as proper chunks, returns as bytes
     """
-    def __init__(self, filename, nbytes=4):
+    def __init__(self, filename, nbytes=4, interpolation=False):
+        """
+        :param interpolation: bool Use interpolation_search instead of binary_search, fewer probes (seeks) on
+                              uniformly distributed items like CRC32s
+        """
         self._filename = filename
         self._file = None
         self._len = 0
         self._nbytes = nbytes
+        self._interpolation = interpolation
 
     def __enter__(self):
         size = os.stat(self._filename).st_size
@@ -222,16 +374,7 @@ class SortedBytesFile(ASortedBytes):
         return self
 
     def __getitem__(self, item):
-        if type(item) is slice:
-            if item.stop or item.step:
-                raise NotImplementedError("Slice not supported atm")
-            item = item.start
-        if type(item) is not int:
-            raise NotImplementedError("Only supporting integers as item keys")
-        if item < 0:
-            item = self._len + item
-        if item < 0 or item >= self._len:
-            raise IndexError("Index %d out of range" % item)
+        item = self._index(item)
         self._file.seek(item * self._nbytes)
         return self._file.read(self._nbytes)
 
@@ -246,14 +389,160 @@ class SortedBytesFile(ASortedBytes):
             self._file.close()
 
 
+class SortedBytesMmapFile(SortedBytesFile):
+    r"""
+    Memory maps the file instead of doing a seek + read for every probe, the OS page cache does the rest.
+    Has no file position, so one opened instance can be shared across threads.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix='.crc') as f:
+    ...     _ = f.write(b''.join(Chunk.from_int(i).data for i in sorted(range(0, 1000, 3),
+    ...                                                          key=lambda i: Chunk.from_int(i).data)))
+    ...     f.flush()
+    ...     with SortedBytesMmapFile(f.name) as reader:
+    ...         print(len(reader), reader[0], reader[-1])
+    ...         print(Chunk.from_int(999).data in reader, Chunk.from_int(998).data in reader)
+    334 b'\x00\x00\x00\x00' b'\xff\x00\x00\x00'
+    True False
+    """
+    def __init__(self, filename, nbytes=4, interpolation=False):
+        super().__init__(filename, nbytes, interpolation)
+        self._mmap = None
+
+    def __enter__(self):
+        size = os.stat(self._filename).st_size
+        if size % self._nbytes:
+            raise EOFError("Expected size of multiple of %sB" % self._nbytes)
+        if size == 0:
+            # mmap doesn't support empty files
+            return EmptySortedBytes()
+        self._len = size // self._nbytes
+        with open(self._filename, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self
+
+    def __getitem__(self, item):
+        item = self._index(item)
+        return self._mmap[item * self._nbytes:(item + 1) * self._nbytes]
+
+    def __contains__(self, item):
+        if self._interpolation:
+            return super().__contains__(item)
+        self.assert_valid_item(item)
+        return buffer_contains(self._mmap, self._nbytes, self._len, item)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._mmap:
+            self._mmap.close()
+            self._mmap = None
+
+
+class SortedBytesPool:
+    r"""
+    Process wide LRU pool of files loaded in memory, bounded by the total size of the loaded files. Entries are
+    reloaded when the file changed (size or mtime).
+
+    >>> import tempfile
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> files = [os.path.join(tmp.name, '%d.crc' % i) for i in range(3)]
+    >>> for file in files:
+    ...     with open(file, 'wb') as f:
+    ...         _ = f.write(b'\x00' * 40)
+    >>> pool = SortedBytesPool(max_bytes=80)
+    >>> [len(pool.get(file)) for file in files + files[2:]]
+    [40, 40, 40, 40]
+    >>> pool.stats()
+    {'files': 2, 'bytes': 80, 'max_bytes': 80, 'hits': 1, 'misses': 3}
+    >>> files[0] in pool, files[2] in pool
+    (False, True)
+    >>> tmp.cleanup()
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filename) -> bytes:
+        stat = os.stat(filename)
+        version = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(filename)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        with open(filename, 'rb') as file:
+            data = file.read()
+
+        if len(data) > self.max_bytes:
+            return data
+
+        with self._lock:
+            old = self._entries.pop(filename, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[filename] = (version, data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+        return data
+
+    def __contains__(self, filename):
+        return filename in self._entries
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        return {'files': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses}
+
+
+# shared by all CachedSortedBytesFiles that don't get their own pool
+sorted_bytes_pool = SortedBytesPool()
+
+
 class CachedSortedBytesFile:
-    def __init__(self, filename):
+    """
+    Reads the file in memory through a SortedBytesPool, repeated lookups in hot files skip file I/O entirely.
+    Can be used as `reader` for SortedBytesDirectory.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix='.crc') as f:
+    ...     _ = f.write(b''.join(sorted(Chunk.from_int(i).data for i in range(0, 1000, 3))))
+    ...     f.flush()
+    ...     pool = SortedBytesPool()
+    ...     for _ in range(2):
+    ...         with CachedSortedBytesFile(f.name, pool=pool) as reader:
+    ...             print(len(reader), Chunk.from_int(999).data in reader, Chunk.from_int(998).data in reader)
+    ...     print(pool.hits)
+    334 True False
+    334 True False
+    1
+    """
+    def __init__(self, filename, nbytes=4, pool=None):
         self._filename = filename
+        self._nbytes = nbytes
+        self._pool = sorted_bytes_pool if pool is None else pool
 
     def __enter__(self):
-        with open(self._filename, 'r') as file:
-            data = file.read()
-        return SortedBytesMemory(data)
+        data = self._pool.get(self._filename)
+        if not data:
+            return EmptySortedBytes()
+        if len(data) % self._nbytes:
+            raise EOFError("Expected size of multiple of %sB" % self._nbytes)
+        return SortedBytesMemory(data, self._nbytes)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
 
 
 class SortedBytesMemory(ASortedBytes):
@@ -267,22 +556,32 @@ class SortedBytesMemory(ASortedBytes):
         self._nbytes = nbytes
 
     def __getitem__(self, item):
-        if type(item) is slice:
-            if item.stop or item.step:
-                raise NotImplementedError("Slice not supported atm")
-            item = item.start
-        if type(item) is not int:
-            raise NotImplementedError("Only supporting integers as item keys")
-        if item < 0:
-            item = self._len + item
-        if item < 0 or item >= self._len:
-            raise IndexError("Index %d out of range" % item)
-        return self._data[item * self._nbytes]
+        item = self._index(item)
+        return self._data[item * self._nbytes:(item + 1) * self._nbytes]
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __contains__(self, item):
+        self.assert_valid_item(item)
+        if not self._len:
+            return False
+        return buffer_contains(self._data, self._nbytes, self._len, item)
 
 
 class SortedChunksFile(SortedBytesFile):
-    """
+    r"""
     Reads the 32-bit int files as proper chunks, returns as Chunk
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix='.crc') as f:
+    ...     _ = f.write(b''.join(sorted(Chunk.from_int(i).data for i in range(0, 1000, 3))))
+    ...     f.flush()
+    ...     for interpolation in (False, True):
+    ...         with SortedChunksFile(f.name, interpolation=interpolation) as reader:
+    ...             print(Chunk.from_int(999) in reader, Chunk.from_int(998) in reader)
+    True False
+    True False
     """
     def __getitem__(self, item: int):
         return Chunk(super().__getitem__(item))
@@ -292,53 +591,423 @@ class SortedChunksFile(SortedBytesFile):
             raise KeyError("Expected a Chunk")
 
 
-def file_contains(file, checksums):
-    with SortedBytesFile(file) as reader:
-        return all(checksum in reader for checksum in checksums)
+class SortedBytesArray(ASortedBytes):
+    r"""
+    NumPy engine: loads (or memory maps) the file as one array and answers many checksums at once with
+    np.searchsorted. Items are compared as big endian unsigned ints, which keeps the byte order of the files.
+
+    >>> import tempfile
+    >>> values = sorted((Chunk.from_int(i).data for i in range(0, 1000, 3)))
+    >>> with tempfile.NamedTemporaryFile(suffix='.crc') as f:
+    ...     _ = f.write(b''.join(values))
+    ...     f.flush()
+    ...     with SortedBytesArray(f.name) as reader:
+    ...         print(len(reader), reader[-1], values[5] in reader)
+    ...         print(reader.contains_many([values[5], Chunk.from_int(1).data, values[0]]))
+    ...         print(reader.search_many([values[5], Chunk.from_int(1).data, values[0]]))
+    334 b'\xff\x00\x00\x00' True
+    [ True False  True]
+    [ 5 -1  0]
+    """
+    def __init__(self, filename, nbytes=4, use_mmap=True):
+        if np is None:
+            raise ImportError("SortedBytesArray requires numpy")
+        self._filename = filename
+        self._nbytes = nbytes
+        self._use_mmap = use_mmap
+        self._dtype = self.dtype(nbytes)
+        self._data = None
+        self._len = 0
+
+    @staticmethod
+    def dtype(nbytes=4):
+        if nbytes in (1, 2, 4, 8):
+            return np.dtype('>u%d' % nbytes)
+        return np.dtype('S%d' % nbytes)
+
+    @classmethod
+    def keys(cls, checksums, nbytes=4):
+        """
+        Convert a list of checksums (bytes) to an array usable by search_many/contains_many, do this once when
+        searching many files
+        """
+        if np is not None and isinstance(checksums, np.ndarray):
+            return checksums
+        checksums = list(checksums)
+        if any(len(checksum) != nbytes for checksum in checksums):
+            raise KeyError("Expected length of %s" % nbytes)
+        return np.frombuffer(b''.join(checksums), dtype=cls.dtype(nbytes))
+
+    def __enter__(self):
+        size = os.stat(self._filename).st_size
+        if size % self._nbytes:
+            raise EOFError("Expected size of multiple of %sB" % self._nbytes)
+        self._len = size // self._nbytes
+        if size == 0:
+            self._data = np.empty(0, dtype=self._dtype)
+        elif self._use_mmap:
+            self._data = np.memmap(self._filename, dtype=self._dtype, mode='r')
+        else:
+            self._data = np.fromfile(self._filename, dtype=self._dtype)
+        return self
+
+    def __getitem__(self, item):
+        item = self._index(item)
+        return self._data[item:item + 1].tobytes()
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __contains__(self, item):
+        self.assert_valid_item(item)
+        return bool(self.contains_many([item])[0])
+
+    def search_many(self, checksums):
+        """
+        :return: np.ndarray Index of every checksum in the file, -1 if not found
+        """
+        keys = self.keys(checksums, self._nbytes)
+        if not self._len:
+            return np.full(len(keys), -1, dtype=np.int64)
+        idx = np.searchsorted(self._data, keys)
+        found = self._data[np.minimum(idx, self._len - 1)] == keys
+        return np.where(found, idx, -1)
+
+    def contains_many(self, checksums):
+        """
+        :return: np.ndarray Boolean mask, True for every checksum found in the file
+        """
+        return self.search_many(checksums) >= 0
+
+    def __repr__(self):
+        return '<%s %s[%d]>' % (type(self).__name__, self._filename, self._len)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # the memmap gets closed once the last view on it is gone
+        self._data = None
+
+
+def read_sorted_bytes(filename, nbytes=4, buffer_items=65536):
+    """
+    Stream the items of a sorted bytes file (eg. .crc) without loading it completely
+    """
+    size = nbytes * buffer_items
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(size)
+            if not data:
+                return
+            if len(data) % nbytes:
+                raise EOFError("Expected size of multiple of %sB" % nbytes)
+            for i in range(0, len(data), nbytes):
+                yield data[i:i + nbytes]
+
+
+def file_contains(file, checksums, reader=None):
+    """
+    :param reader: type Class used to read the file, eg. SortedBytesMmapFile (defaults to SortedBytesFile)
+    """
+    if reader is None:
+        reader = SortedBytesFile
+    with reader(file) as reader_:
+        return all(checksum in reader_ for checksum in checksums)
+
+
+def numpy_file_contains(file, checksums, nbytes=4):
+    with SortedBytesArray(file, nbytes) as reader:
+        return bool(reader.contains_many(checksums).all())
+
+
+_worker_search = None
+
+
+def _init_search_worker(shm_name, size, nbytes, contains, engine):
+    global _worker_search
+    shm = SharedMemory(name=shm_name)
+    try:
+        data = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+    checksums = [data[i:i + nbytes] for i in range(0, size, nbytes)]
+    if engine == 'numpy':
+        checksums = SortedBytesArray.keys(checksums, nbytes)
+    _worker_search = (contains, checksums)
+
+
+def _search_files(files):
+    contains, checksums = _worker_search
+    return [file for file in files if contains(file, checksums)], len(files)
 
 
 class SortedBytesDirectory:
-    def __init__(self, path, suffix=None):
+    r"""
+    >>> import tempfile
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> for name, ints in (('a', range(0, 100)), ('b', range(100, 200))):
+    ...     with open(os.path.join(tmp.name, name + '.crc'), 'wb') as f:
+    ...         _ = f.write(b''.join(sorted(i.to_bytes(4, 'little') for i in ints)))
+    >>> directory = SortedBytesDirectory(tmp.name, filters=True)
+    >>> directory.build_filters()
+    2
+    >>> directory.build_filters()
+    0
+    >>> checksums = [(150).to_bytes(4, 'little')]
+    >>> [directory.basename(f) for f in directory.search(checksums)]
+    ['b']
+    >>> [directory.basename(f) for f in directory.candidates(directory.files(), checksums)]
+    ['b']
+    >>> with open(os.path.join(tmp.name, 'a.crc'), 'wb') as f:
+    ...     _ = f.write(b''.join(sorted(i.to_bytes(4, 'little') for i in range(100, 110))))
+    >>> sorted(directory.basename(f) for f in directory.search([(105).to_bytes(4, 'little')]))
+    ['a', 'b']
+    >>> with open(directory.filter_filename(os.path.join(tmp.name, 'b.crc')), 'r+b') as f:
+    ...     _ = f.truncate(20)
+    >>> [directory.basename(f) for f in SortedBytesDirectory(tmp.name, filters=True).search(checksums)]
+    ['b']
+    >>> tmp.cleanup()
+    """
+    filter_suffix = '.bloom'
+
+    def __init__(self, path, suffix=None, reader=None, filters=False, recursive=False):
+        """
+        :param reader: type Class used to read the files, eg. SortedBytesMmapFile (defaults to SortedBytesFile)
+        :param filters: bool Use the bloom filter sidecars (see build_filters) to skip files without disk access
+        :param recursive: bool Include the files in subdirectories
+        """
         self._path = os.fsencode(path)
         if suffix is None:
             suffix = '.crc'
         self._suffix = suffix
+        self._reader = reader
+        self._filters = {} if filters else None
+        self._recursive = recursive
+
+    def filter_filename(self, file):
+        return file + self.filter_suffix
+
+    def _filter_is_fresh(self, file):
+        try:
+            return os.stat(self.filter_filename(file)).st_mtime_ns >= os.stat(file).st_mtime_ns
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def _version(file):
+        stat = os.stat(file)
+        return stat.st_size, stat.st_mtime_ns
+
+    def build_filters(self, false_positive_rate=.01, force=False, nbytes=4) -> int:
+        """
+        Write a bloom filter sidecar for every file without an up to date one
+
+        :return: int Amount of filters built
+        """
+        built = 0
+        for file in self.files():
+            if not force and self._filter_is_fresh(file):
+                continue
+            version = self._version(file)
+            bloom = BloomFilter.for_capacity(version[0] // nbytes, false_positive_rate)
+            bloom.update(read_sorted_bytes(file, nbytes))
+            bloom.save(self.filter_filename(file))
+            if self._filters is not None:
+                self._filters[file] = version, bloom
+            built += 1
+        return built
+
+    def _filter(self, file):
+        """
+        The filter of a file, cached for as long as the file's size and mtime don't change (a stale filter would
+        give false negatives)
+        """
+        try:
+            version = self._version(file)
+        except FileNotFoundError:
+            self._filters.pop(file, None)
+            return None
+        cached = self._filters.get(file)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        bloom = None
+        if self._filter_is_fresh(file):
+            try:
+                bloom = BloomFilter.load(self.filter_filename(file))
+            except (OSError, ValueError) as e:
+                logger.warning('Ignoring filter for %s: %s', file, e)
+        self._filters[file] = version, bloom
+        return bloom
+
+    def candidates(self, files, checksums):
+        """
+        Drop the files whose filter rules out any of the checksums, files without a filter are kept
+        """
+        if self._filters is None:
+            yield from files
+            return
+        hashed = [BloomFilter.hash(checksum) for checksum in checksums]
+        for file in files:
+            bloom = self._filter(file)
+            if bloom is None or all(bloom.contains_hashed(h) for h in hashed):
+                yield file
 
     def basename(self, file):
         return os.path.basename(file)[:-len(self._suffix)]
 
     def files(self):
-        prefix = None
+        """
+        Stream the matching files with os.scandir (recursing into subdirectories if `recursive`), so searches can
+        start before the whole directory is listed
+        """
         if os.path.isfile(self._path):
-            files = [self._path]
-        else:
-            prefix = self._path
-            files = os.listdir(self._path)
-
-        for file in files:
-            if prefix:
-                file = os.path.join(prefix, file)
-
-            filename = os.fsdecode(file)
-            if filename.endswith('.crc'):
+            filename = os.fsdecode(self._path)
+            if filename.endswith(self._suffix):
                 yield filename
-
-    def search(self, checksums):
-        files = list(self.files())
+            return
+        yield from self._scan(self._path)
+
+    def _scan(self, path):
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    filename = os.fsdecode(entry.path)
+                    if filename.endswith(self._suffix):
+                        yield filename
+                elif self._recursive and entry.is_dir(follow_symlinks=False):
+                    yield from self._scan(entry.path)
+
+    def _contains(self, engine, nbytes=4):
+        if engine is None:
+            return partial(file_contains, reader=self._reader)
+        if engine == 'numpy':
+            return partial(numpy_file_contains, nbytes=nbytes)
+        raise ValueError("Unknown engine '%s'" % engine)
+
+    def _keys(self, checksums, engine, nbytes=4):
+        if engine == 'numpy':
+            # convert only once for all files
+            return SortedBytesArray.keys(checksums, nbytes)
+        return checksums
+
+    def search(self, checksums, engine=None, limit=None):
+        """
+        :param engine: str|None None for a binary search per checksum, 'numpy' for SortedBytesArray
+        :param limit: int Stop (listing and searching) after this many matches
+
+        >>> import tempfile
+        >>> tmp = tempfile.TemporaryDirectory()
+        >>> os.makedirs(os.path.join(tmp.name, 'sub', 'subsub'))
+        >>> for name in ('a.crc', 'b.dat', os.path.join('sub', 'c.crc'), os.path.join('sub', 'subsub', 'd.dat')):
+        ...     with open(os.path.join(tmp.name, name), 'wb') as f:
+        ...         _ = f.write((1).to_bytes(4, 'little'))
+        >>> checksums = [(1).to_bytes(4, 'little')]
+        >>> [SortedBytesDirectory(tmp.name).basename(f) for f in SortedBytesDirectory(tmp.name).search(checksums)]
+        ['a']
+        >>> sorted(os.path.relpath(f, tmp.name) for f in SortedBytesDirectory(tmp.name, '.dat', recursive=True).files())
+        ['b.dat', 'sub/subsub/d.dat']
+        >>> len(list(SortedBytesDirectory(tmp.name, recursive=True).search(checksums)))
+        2
+        >>> len(list(SortedBytesDirectory(tmp.name, recursive=True).search(checksums, limit=1)))
+        1
+        >>> len(SortedBytesDirectory(tmp.name, recursive=True).search_multithread(checksums, 2, limit=1))
+        1
+        >>> tmp.cleanup()
+        """
+        if limit is not None and limit <= 0:
+            return
+        checksums = list(checksums)
+        contains = self._contains(engine)
+        files = self.candidates(self.files(), checksums)
+        checksums = self._keys(checksums, engine)
+        found = 0
         for file in tqdm(files):
-            if file_contains(file, checksums):
+            if contains(file, checksums):
+                yield file
+                found += 1
+                if limit is not None and found >= limit:
+                    return
+
+    def search_multithread(self, checksums, threads=5, engine=None, limit=None):
+        """
+        :param limit: int Stop listing and searching after about this many matches (the result is truncated to it)
+        """
+        checksums = list(checksums)
+        pbar = tqdm()
+        found = []
+
+        def files():
+            for file in self.candidates(self.files(), checksums):
+                if limit is not None and len(found) >= limit:
+                    return
                 yield file
 
-    def search_multithread(self, checksums, threads=5):
-        files = list(self.files())
-        pbar = tqdm(total=len(files))
+        contains = self._contains(engine)
+        checksums = self._keys(checksums, engine)
 
-        @multithreaded(threads, pbar=pbar)
+        @multithreaded(threads, pbar=pbar, pre_start=True)
         def lookup(checksums_, file, *args, **kwargs):
-            if file_contains(file, checksums_):
+            if limit is not None and len(found) >= limit:
+                return
+            if contains(file, checksums_):
+                found.append(file)
                 return file
 
-        return lookup(files, checksums)
+        with lookup._multithread:
+            result = lookup(files(), checksums)
+        pbar.close()
+        return result if limit is None else result[:limit]
+
+    def search_parallel(self, checksums, processes=None, chunksize=8, engine=None, nbytes=4, limit=None):
+        """
+        Like search, but the files are partitioned over a process pool, so the (pure python) binary searches run
+        on all cores instead of fighting over the GIL. The checksums are passed once through shared memory,
+        matching files are yielded as soon as a worker finds them (in no particular order).
+
+        :param processes: int Amount of processes, defaults to the amount of cpus
+        :param chunksize: int Amount of files handed to a worker at once
+        :param limit: int Stop after this many matches
+
+        >>> import tempfile
+        >>> tmp = tempfile.TemporaryDirectory()
+        >>> for i in range(20):
+        ...     with open(os.path.join(tmp.name, '%02d.crc' % i), 'wb') as f:
+        ...         _ = f.write(b''.join(sorted(n.to_bytes(4, 'little') for n in range(i, i + 5))))
+        >>> directory = SortedBytesDirectory(tmp.name)
+        >>> checksums = [(n).to_bytes(4, 'little') for n in (7, 8)]
+        >>> sorted(directory.basename(f) for f in directory.search_parallel(checksums, processes=2, chunksize=3))
+        ['04', '05', '06', '07']
+        >>> sorted(directory.search_parallel(checksums, 2, engine='numpy')) == sorted(directory.search(checksums))
+        True
+        >>> with open(os.path.join(tmp.name, 'wide.dat'), 'wb') as f:
+        ...     _ = f.write(b''.join(sorted(n.to_bytes(8, 'little') for n in (3, 2 ** 40 + 5, 2 ** 50))))
+        >>> wide = SortedBytesDirectory(tmp.name, '.dat')
+        >>> [wide.basename(f) for f in wide.search_parallel([(2 ** 40 + 5).to_bytes(8, 'little')], 2, engine='numpy',
+        ...                                                 nbytes=8)]
+        ['wide']
+        >>> tmp.cleanup()
+        """
+        checksums = list(checksums)
+        files = self.candidates(self.files(), checksums)
+        data = b''.join(checksums)
+        if any(len(checksum) != nbytes for checksum in checksums):
+            raise KeyError("Expected length of %s" % nbytes)
+
+        matches = 0
+        shm = SharedMemory(create=True, size=max(1, len(data)))
+        try:
+            shm.buf[:len(data)] = data
+            initargs = (shm.name, len(data), nbytes, self._contains(engine, nbytes), engine)
+            with Pool(processes, initializer=_init_search_worker, initargs=initargs) as pool, tqdm() as pbar:
+                # the pool feeds itself from the (streaming) listing in a background thread
+                for found, n in pool.imap_unordered(_search_files, _chunked(files, chunksize)):
+                    pbar.update(n)
+                    for file in found:
+                        yield file
+                        matches += 1
+                        if limit is not None and matches >= limit:
+                            return
+        finally:
+            shm.close()
+            shm.unlink()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,380 @@
+"""
+Benchmarks for the binarysearch engines
+
+Usage (from the parent directory):
+
+    python3 -m pythonmodules.binarysearch_benchmark --sizes 1000,1000000,100000000 --output run.json
+    python3 -m pythonmodules.binarysearch_benchmark --compare before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from . import binarysearch, blockdelta, eytzinger, crcbuilder
+from .binarysearch import SortedBytesDirectory, binary_search_recursive, np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def generate(filename, n, nbytes=4, seed=0):
+    """
+    Write a synthetic sorted file of (about, duplicates are dropped) n random items
+
+    :return: int Amount of items written
+
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     n = generate(os.path.join(tmp, 'a.crc'), 1000, seed=1)
+    ...     n == crcbuilder.validate(os.path.join(tmp, 'a.crc')), 990 < n <= 1000
+    (True, True)
+    """
+    if np is not None and nbytes in (1, 2, 4, 8):
+        # big endian ints sort like the bytes they're written as
+        rng = np.random.default_rng(seed)
+        values = np.unique(rng.integers(0, 2 ** (8 * nbytes), n, dtype=np.uint64, endpoint=False))
+        values.astype('>u%d' % nbytes).tofile(filename)
+        return len(values)
+    rnd = random.Random(seed)
+    items = (rnd.getrandbits(8 * nbytes).to_bytes(nbytes, 'little') for _ in range(n))
+    return crcbuilder.build([items], filename, nbytes, processes=0)
+
+
+class CountingFile:
+    """File proxy counting the seek/read syscalls"""
+    def __init__(self, file):
+        self._file = file
+        self.syscalls = 0
+
+    def seek(self, *args):
+        self.syscalls += 1
+        return self._file.seek(*args)
+
+    def read(self, *args):
+        self.syscalls += 1
+        return self._file.read(*args)
+
+    def close(self):
+        return self._file.close()
+
+
+_counting_classes = {}
+
+
+def counting(reader_class):
+    """
+    Subclass of a reader that counts probes (__getitem__ calls) and syscalls (if it reads through a file object)
+    """
+    try:
+        return _counting_classes[reader_class]
+    except KeyError:
+        pass
+    def __enter__(self):
+        reader = reader_class.__enter__(self)
+        if reader is self and getattr(self, '_file', None) is not None:
+            self._file = CountingFile(self._file)
+        return reader
+
+    def __getitem__(self, item):
+        self.probes += 1
+        return reader_class.__getitem__(self, item)
+
+    cls = type('Counting%s' % reader_class.__name__, (reader_class,),
+               {'__enter__': __enter__, '__getitem__': __getitem__, 'probes': 0})
+    _counting_classes[reader_class] = cls
+    return cls
+
+
+class RecursiveSortedBytesFile(binarysearch.SortedBytesFile):
+    def __contains__(self, item):
+        self.assert_valid_item(item)
+        return binary_search_recursive(self, item) is not None
+
+
+class ChunkKeys(binarysearch.SortedChunksFile):
+    """SortedChunksFile taking bytes, so all engines get the same queries"""
+    def __contains__(self, item):
+        return super().__contains__(binarysearch.Chunk(item))
+
+    def assert_valid_item(self, item):
+        pass
+
+
+class NumpyMultiKey(binarysearch.SortedBytesArray):
+    """Answers a multi-key query in one go instead of a lookup per key"""
+    multi_key = True
+
+
+def _convert(module, suffix):
+    def _(src):
+        dst = src + suffix
+        if not os.path.exists(dst):
+            module.convert(src, dst)
+        return dst
+    return _
+
+
+# name => (reader class, optional conversion of the source file, whether probes go through __getitem__)
+ENGINES = {
+    'binary_search': (binarysearch.SortedBytesFile, None, True),
+    'binary_search_recursive': (RecursiveSortedBytesFile, None, True),
+    'chunks': (ChunkKeys, None, True),
+    'interpolation': (lambda f: binarysearch.SortedBytesFile(f, interpolation=True), None, True),
+    'mmap': (binarysearch.SortedBytesMmapFile, None, False),
+    'memory': (binarysearch.CachedSortedBytesFile, None, False),
+    'numpy': (NumpyMultiKey, None, False),
+    'eytzinger': (eytzinger.EytzingerFile, _convert(eytzinger, '.eytz'), False),
+    'blockdelta': (blockdelta.BlockDeltaFile, _convert(blockdelta, '.bdc'), False),
+}
+
+
+def _reader_class(engine):
+    reader, _, count_probes = ENGINES[engine]
+    if count_probes and isinstance(reader, type):
+        return counting(reader)
+    if count_probes:
+        # factory (eg. a partial mode of a reader), count on the class it instantiates
+        return lambda f: _recount(reader(f))
+    return reader
+
+
+def _recount(instance):
+    instance.__class__ = counting(type(instance))
+    return instance
+
+
+def drop_cache(filename):
+    """
+    Ask the OS to drop the cached pages of a file (best effort, without root)
+    """
+    binarysearch.sorted_bytes_pool.clear()
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+def _keys(filename, n, hit_rate=.5, seed=0, nbytes=4):
+    """
+    n query keys, about hit_rate of them present in the file
+    """
+    rnd = random.Random(seed)
+    count = os.stat(filename).st_size // nbytes
+    keys = []
+    with open(filename, 'rb') as f:
+        for _ in range(n):
+            if count and rnd.random() < hit_rate:
+                f.seek(rnd.randrange(count) * nbytes)
+                keys.append(f.read(nbytes))
+            else:
+                keys.append(rnd.getrandbits(8 * nbytes).to_bytes(nbytes, 'little'))
+    return keys
+
+
+def _measure(fn, filenames, cold):
+    """
+    Seconds taken by fn, after dropping the filenames from the page cache (cold) or a warm-up call (warm)
+    """
+    if cold:
+        for filename in filenames:
+            drop_cache(filename)
+    else:
+        fn()
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def bench_file(engine, src, keys, cold=False):
+    """
+    Single key (open + 1 lookup per key) and multi key (1 open, all keys) queries on one file. The timed runs use
+    the plain reader, probes and syscalls are counted in a separate, untimed run.
+    """
+    plain_class = ENGINES[engine][0]
+    counting_class = _reader_class(engine)
+    convert = ENGINES[engine][1]
+    filename = convert(src) if convert else src
+
+    def totals(readers):
+        return {
+            'probes': sum(getattr(r, 'probes', 0) for r in readers) if ENGINES[engine][2] else None,
+            'syscalls': sum(r._file.syscalls for r in readers if isinstance(getattr(r, '_file', None), CountingFile))
+            if ENGINES[engine][2] else None,
+        }
+
+    def single(reader_class):
+        readers = []
+        for key in keys:
+            with reader_class(filename) as r:
+                _ = key in r
+                readers.append(r)
+        return readers
+
+    def multi(reader_class):
+        with reader_class(filename) as r:
+            if getattr(r, 'multi_key', False):
+                r.contains_many(keys)
+            else:
+                for key in keys:
+                    _ = key in r
+            return [r]
+
+    results = {}
+    for mode, fn in (('single', single), ('multi', multi)):
+        stats = totals(fn(counting_class) if ENGINES[engine][2] else [])
+        stats['seconds'] = _measure(lambda: fn(plain_class), [filename], cold)
+        stats['latency_us'] = stats['seconds'] / len(keys) * 1e6
+        stats['throughput'] = len(keys) / stats['seconds'] if stats['seconds'] else None
+        results[mode] = stats
+    return results
+
+
+def bench_directory(engine, directory, checksums, cold=False):
+    """
+    Directory wide search (SortedBytesDirectory.search) for a few checksums
+    """
+    reader_class = ENGINES[engine][0]
+    convert = ENGINES[engine][1]
+    files = list(SortedBytesDirectory(directory).files())
+    suffix = '.crc'
+    if convert:
+        # the converted files are the ones read (and so the ones to drop from the cache)
+        files = [convert(file) for file in files]
+        suffix = '.crc' + ('.eytz' if engine == 'eytzinger' else '.bdc')
+    found = []
+
+    def search():
+        d = SortedBytesDirectory(directory, suffix=suffix, reader=reader_class)
+        found[:] = d.search(checksums) if engine != 'numpy' else d.search(checksums, engine='numpy')
+
+    stats = {'seconds': _measure(search, files, cold)}
+    stats['matches'] = len(found)
+    stats['files'] = len(files)
+    stats['throughput'] = len(files) / stats['seconds'] if stats['seconds'] else None
+    return stats
+
+
+def run(sizes=(1000, 100000), engines=None, queries=1000, directory_files=20, modes=('warm', 'cold'), seed=0,
+        tmpdir=None):
+    """
+    Run all benchmarks on freshly generated synthetic files
+
+    :return: dict JSON-able results
+
+    >>> res = run(sizes=[1000], engines=['binary_search', 'mmap', 'numpy'], queries=50, directory_files=3,
+    ...           modes=['warm'])
+    >>> sorted(res['results']['1000']['warm'].keys())
+    ['binary_search', 'mmap', 'numpy']
+    >>> r = res['results']['1000']['warm']['binary_search']
+    >>> r['single']['probes'] > 0, r['multi']['syscalls'] > 0, r['directory']['files']
+    (True, True, 3)
+    """
+    if engines is None:
+        engines = [engine for engine in ENGINES if engine != 'numpy' or np is not None]
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='binarysearch_benchmark', dir=tmpdir)
+    try:
+        for size in sizes:
+            src = os.path.join(workdir, 'single_%d.crc' % size)
+            count = generate(src, size, seed=seed)
+            keys = _keys(src, queries, seed=seed)
+            directory = os.path.join(workdir, 'dir_%d' % size)
+            os.makedirs(directory)
+            for i in range(directory_files):
+                generate(os.path.join(directory, '%d.crc' % i), max(1, size // directory_files), seed=seed + i + 1)
+            checksums = _keys(os.path.join(directory, '0.crc'), 2, hit_rate=1, seed=seed)
+
+            results[str(size)] = {}
+            for mode in modes:
+                by_engine = {}
+                for engine in engines:
+                    logger.info('size %d, %s, %s', size, mode, engine)
+                    stats = bench_file(engine, src, keys, cold=mode == 'cold')
+                    stats['directory'] = bench_directory(engine, directory, checksums, cold=mode == 'cold')
+                    stats['items'] = count
+                    by_engine[engine] = stats
+                results[str(size)][mode] = by_engine
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'date': datetime.now().isoformat(),
+            'python': sys.version,
+            'platform': platform.platform(),
+            'queries': queries,
+            'directory_files': directory_files,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def compare(before, after):
+    """
+    Ratio (after / before) of the single, multi and directory seconds of two runs
+    :return: dict size => mode => engine => {kind: ratio}
+    """
+    ratios = {}
+    for size, modes in after['results'].items():
+        for mode, engines in modes.items():
+            for engine, stats in engines.items():
+                try:
+                    old = before['results'][size][mode][engine]
+                except KeyError:
+                    continue
+                ratios.setdefault(size, {}).setdefault(mode, {})[engine] = {
+                    kind: stats[kind]['seconds'] / old[kind]['seconds'] if old[kind]['seconds'] else None
+                    for kind in ('single', 'multi', 'directory')
+                }
+    return ratios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the binarysearch engines')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000',
+                        help='comma separated amount of items per file (eg. up to 100000000)')
+    parser.add_argument('--engines', default=None, help='comma separated, one or more of %s' % ', '.join(ENGINES))
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--directory-files', type=int, default=20)
+    parser.add_argument('--modes', default='warm,cold')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tmpdir', default=None)
+    parser.add_argument('--output', default=None, help='write the results as JSON to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two JSON results')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            before = json.load(f)
+        with open(args.compare[1]) as f:
+            after = json.load(f)
+        print(json.dumps(compare(before, after), indent=2))
+        return
+
+    results = run(sizes=[int(size) for size in args.sizes.split(',')],
+                  engines=args.engines.split(',') if args.engines else None,
+                  queries=args.queries,
+                  directory_files=args.directory_files,
+                  modes=args.modes.split(','),
+                  seed=args.seed,
+                  tmpdir=args.tmpdir)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import mmap
+import os
+import struct
+from bisect import bisect_right
+from .binarysearch import ASortedBytes, EmptySortedBytes, read_sorted_bytes
+
+import logging
+logger = logging.getLogger(__name__)
+
+MAGIC = b'BDLT'
+VERSION = 1
+# magic, version, nbytes, block_size, count, index offset
+HEADER = struct.Struct('<4sHHIQQ')
+INDEX_ENTRY = struct.Struct('<QQ')
+
+
+def encode_varint(n, out: bytearray):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def decode_varints(data):
+    """
+    >>> out = bytearray()
+    >>> for n in (0, 1, 127, 128, 300, 2 ** 32):
+    ...     encode_varint(n, out)
+    >>> list(decode_varints(bytes(out)))
+    [0, 1, 127, 128, 300, 4294967296]
+    """
+    n = shift = 0
+    for byte in data:
+        n |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield n
+            n = shift = 0
+
+
+def write(items, dst, nbytes=4, block_size=128):
+    """
+    Write sorted, unique items (bytes of nbytes long) as blocks of varint encoded deltas. The first value of
+    every block goes in the block index at the end of the file, so any block decodes on its own.
+
+    :return: int Amount of items written
+    """
+    index = []
+    count = 0
+    prev = None
+    block = bytearray()
+    tmp = dst + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, nbytes, block_size, 0, 0))
+        offset = HEADER.size
+        for item in items:
+            if len(item) != nbytes:
+                raise KeyError("Expected length of %s" % nbytes)
+            value = int.from_bytes(item, 'big')
+            if prev is not None and value <= prev:
+                raise ValueError("Items need to be sorted and unique (item %d)" % count)
+            if count % block_size == 0:
+                if block:
+                    f.write(block)
+                    offset += len(block)
+                    block = bytearray()
+                index.append((value, offset))
+            else:
+                encode_varint(value - prev, block)
+            prev = value
+            count += 1
+        f.write(block)
+        offset += len(block)
+        for entry in index:
+            f.write(INDEX_ENTRY.pack(*entry))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, nbytes, block_size, count, offset))
+    os.replace(tmp, dst)
+    return count
+
+
+def convert(src, dst, nbytes=4, block_size=128):
+    """
+    Convert a sorted bytes file (eg. .crc) to the block delta format (streaming)
+    """
+    return write(read_sorted_bytes(src, nbytes), dst, nbytes, block_size)
+
+
+class BlockDeltaFile(ASortedBytes):
+    r"""
+    Reader for block delta files. Only the block index (one entry per block) is kept in memory, a lookup is a
+    bisect in the index and decoding a single block. Can be used as `reader` for SortedBytesDirectory.
+
+    >>> import tempfile
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> src, dst = os.path.join(tmp.name, 'a.crc'), os.path.join(tmp.name, 'a.bdc')
+    >>> values = sorted(i.to_bytes(4, 'little') for i in range(0, 100000, 7))
+    >>> with open(src, 'wb') as f:
+    ...     _ = f.write(b''.join(values))
+    >>> convert(src, dst, block_size=64)
+    14286
+    >>> os.stat(dst).st_size < os.stat(src).st_size
+    True
+    >>> with BlockDeltaFile(dst) as reader:
+    ...     print(len(reader), reader[0] == values[0], reader[-1] == values[-1], reader[1000] == values[1000])
+    ...     print(all(v in reader for v in values[::7]))
+    ...     print(any(i.to_bytes(4, 'little') in reader for i in range(1, 100000, 7)))
+    14286 True True True
+    True
+    False
+    >>> from .binarysearch import SortedBytesDirectory
+    >>> directory = SortedBytesDirectory(tmp.name, suffix='.bdc', reader=BlockDeltaFile)
+    >>> [directory.basename(f) for f in directory.search([values[5]])]
+    ['a']
+    >>> write([b'b', b'a'], dst, nbytes=1)
+    Traceback (most recent call last):
+    ...
+    ValueError: Items need to be sorted and unique (item 1)
+    >>> tmp.cleanup()
+    """
+    def __init__(self, filename, nbytes=4):
+        self._filename = filename
+        self._nbytes = nbytes
+        self._len = 0
+        self._block_size = None
+        self._firsts = None
+        self._offsets = None
+        self._mmap = None
+
+    def __enter__(self):
+        with open(self._filename, 'rb') as file:
+            header = file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise EOFError("File too short for header")
+            magic, version, nbytes, block_size, count, index_offset = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError("Not a block delta file (magic %a)" % magic)
+            if version != VERSION:
+                raise ValueError("Unsupported block delta version %d" % version)
+            if nbytes != self._nbytes:
+                raise KeyError("File has items of %dB, expected %dB" % (nbytes, self._nbytes))
+            if count == 0:
+                return EmptySortedBytes()
+            file.seek(index_offset)
+            index = file.read()
+            if len(index) % INDEX_ENTRY.size:
+                raise EOFError("Truncated block index")
+            entries = list(INDEX_ENTRY.iter_unpack(index))
+            self._firsts = [first for first, _ in entries]
+            # end of the last block is the start of the index
+            self._offsets = [offset for _, offset in entries] + [index_offset]
+            self._block_size = block_size
+            self._len = count
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self
+
+    def _block(self, b):
+        value = self._firsts[b]
+        yield value
+        for delta in decode_varints(self._mmap[self._offsets[b]:self._offsets[b + 1]]):
+            value += delta
+            yield value
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, item):
+        item = self._index(item)
+        b, i = divmod(item, self._block_size)
+        for j, value in enumerate(self._block(b)):
+            if j == i:
+                return value.to_bytes(self._nbytes, 'big')
+
+    def __contains__(self, item):
+        self.assert_valid_item(item)
+        k = int.from_bytes(item, 'big')
+        b = bisect_right(self._firsts, k) - 1
+        if b < 0:
+            return False
+        for value in self._block(b):
+            if value >= k:
+                return value == k
+        return False
+
+    def __iter__(self):
+        for b in range(len(self._firsts)):
+            for value in self._block(b):
+                yield value.to_bytes(self._nbytes, 'big')
+
+    def __repr__(self):
+        return '<%s %s[%d]>' % (type(self).__name__, self._filename, self._len)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._mmap:
+            self._mmap.close()
+            self._mmap = None
+
+
+if __name__ == "__main__":
+    # run with `python3 -m pythonmodules.blockdelta` from parent directory
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,125 @@
+import hashlib
+import math
+import os
+import struct
+
+
+class BloomFilter:
+    """
+    Compact probabilistic set: `item in filter` is never False for an added item, but can be True for an item
+    that wasn't added (with the configured false positive rate).
+
+    >>> f = BloomFilter.for_capacity(1000, false_positive_rate=.01)
+    >>> f.update(i.to_bytes(4, 'little') for i in range(1000))
+    >>> all(i.to_bytes(4, 'little') in f for i in range(1000))
+    True
+    >>> false_positives = sum(i.to_bytes(4, 'little') in f for i in range(1000, 11000))
+    >>> false_positives < 250
+    True
+    >>> f2 = BloomFilter.from_bytes(f.to_bytes())
+    >>> (f2.nbits, f2.nhashes) == (f.nbits, f.nhashes), b'\\x01\\x00\\x00\\x00' in f2
+    (True, True)
+    >>> h = BloomFilter.hash(b'\\x01\\x00\\x00\\x00')
+    >>> f2.contains_hashed(h)
+    True
+    """
+    magic = b'BLM1'
+    _header = struct.Struct('<4sQB')
+
+    def __init__(self, nbits, nhashes, bits=None):
+        """
+        :param nbits: int Size of the filter in bits
+        :param nhashes: int Amount of bits set per item
+        """
+        self.nbits = nbits
+        self.nhashes = nhashes
+        self.bits = bytearray((nbits + 7) // 8) if bits is None else bits
+
+    @classmethod
+    def for_capacity(cls, n, false_positive_rate=.01):
+        """
+        Create a filter sized for n items with the given false positive rate
+        """
+        n = max(1, n)
+        nbits = max(8, int(math.ceil(-n * math.log(false_positive_rate) / math.log(2) ** 2)))
+        nhashes = max(1, int(round(nbits / n * math.log(2))))
+        return cls(nbits, nhashes)
+
+    @staticmethod
+    def hash(item):
+        """
+        Hash an item once, the result can be reused on filters of any size (see contains_hashed)
+        :return: tuple
+        """
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+    def _positions(self, hashed):
+        h1, h2 = hashed
+        return ((h1 + i * h2) % self.nbits for i in range(self.nhashes))
+
+    def add(self, item):
+        for pos in self._positions(self.hash(item)):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def contains_hashed(self, hashed):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(hashed))
+
+    def __contains__(self, item):
+        return self.contains_hashed(self.hash(item))
+
+    def to_bytes(self) -> bytes:
+        return self._header.pack(self.magic, self.nbits, self.nhashes) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        :raises ValueError: Not a (complete) bloom filter
+
+        >>> data = BloomFilter.for_capacity(10).to_bytes()
+        >>> BloomFilter.from_bytes(data[:5])
+        Traceback (most recent call last):
+        ...
+        ValueError: Expected a header of 13 bytes, got 5
+        >>> BloomFilter.from_bytes(data[:-1])
+        Traceback (most recent call last):
+        ...
+        ValueError: Expected 12 bytes of filter data, got 11
+        """
+        if len(data) < cls._header.size:
+            raise ValueError("Expected a header of %d bytes, got %d" % (cls._header.size, len(data)))
+        magic, nbits, nhashes = cls._header.unpack_from(data)
+        if magic != cls.magic:
+            raise ValueError("Not a bloom filter (magic %a)" % magic)
+        bits = bytearray(data[cls._header.size:])
+        if len(bits) != (nbits + 7) // 8:
+            raise ValueError("Expected %d bytes of filter data, got %d" % ((nbits + 7) // 8, len(bits)))
+        return cls(nbits, nhashes, bits)
+
+    def save(self, filename):
+        """
+        Write to a temporary file first, so an interrupted save never leaves a truncated filter behind
+        """
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.to_bytes())
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+    def __repr__(self):
+        return '<%s %dB k=%d>' % (type(self).__name__, len(self.bits), self.nhashes)
+
+
+if __name__ == "__main__":
+    # run with `python3 -m pythonmodules.bloomfilter` from parent directory
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,173 @@
+import pickle
+import sqlite3
+import time
+from threading import Lock
+
+import logging
+logger = logging.getLogger(__name__)
+
+DONE = 'done'
+FAILED = 'failed'
+
+
+def default_key(*args) -> str:
+    if len(args) == 1:
+        return args[0] if isinstance(args[0], str) else repr(args[0])
+    return repr(args)
+
+
+class CheckpointStore:
+    """
+    SQLite store of the processed items of a (long) batch run, so a restarted run can pick up where it stopped:
+    items that are done get their stored result without being processed again, failed items are retried with an
+    exponential back-off (`backoff` * 2 ** (attempts - 1) seconds, at most `max_backoff`, also across restarts).
+    Pass it as `checkpoint` to MultiThread, @multithreaded or @singlethreaded.
+
+    :param key: callable Item (the args of a row) => unique str, defaults to the item itself (str) or its repr
+    :param retries: int Amount of retries of a failed item within one run
+
+    >>> import os, tempfile
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> filename = os.path.join(tmp.name, 'run.sqlite')
+    >>> calls = []
+    >>> def fetch(pid):
+    ...     calls.append(pid)
+    ...     if pid == 'p2':
+    ...         raise ConnectionError('timeout for %s' % pid)
+    ...     return pid.upper()
+    >>> store = CheckpointStore(filename, retries=1, backoff=.01)
+    >>> [store.process(fetch, (pid,)) for pid in ('p1', 'p3')]
+    ['P1', 'P3']
+    >>> store.process(fetch, ('p2',))
+    Traceback (most recent call last):
+    ...
+    ConnectionError: timeout for p2
+    >>> store.close()
+    >>> calls
+    ['p1', 'p3', 'p2', 'p2']
+    >>> with CheckpointStore(filename) as store:
+    ...     store.stats(), store.status('p2')['attempts'], sorted(store.results())
+    ({'done': 2, 'failed': 1}, 2, ['P1', 'P3'])
+    >>> calls = []
+    >>> from .multithreading import multithreaded
+    >>> with CheckpointStore(filename) as store:
+    ...     @multithreaded(2, pass_thread_id=False, checkpoint=store)
+    ...     def fetch_all(pid):
+    ...         calls.append(pid)
+    ...         return pid.upper()
+    ...     sorted(fetch_all(['p1', 'p2', 'p3', 'p4'])), sorted(calls), store.stats()
+    (['P1', 'P2', 'P3', 'P4'], ['p2', 'p4'], {'done': 4})
+    >>> tmp.cleanup()
+    """
+    def __init__(self, filename, key=None, retries=3, backoff=1., max_backoff=600.):
+        self.filename = filename
+        self.key = default_key if key is None else key
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.logger = logger
+        self._lock = Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS items (key TEXT PRIMARY KEY, status TEXT NOT NULL, '
+                         'result BLOB, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, next_try REAL, '
+                         'updated REAL NOT NULL)')
+
+    def status(self, key):
+        """
+        :return: dict|None With status, result, attempts, error and next_try
+        """
+        with self._lock:
+            row = self._db.execute('SELECT status, result, attempts, error, next_try FROM items WHERE key = ?',
+                                   (key,)).fetchone()
+        if row is None:
+            return None
+        status, result, attempts, error, next_try = row
+        return {
+            'status': status,
+            'result': pickle.loads(result) if result is not None else None,
+            'attempts': attempts,
+            'error': error,
+            'next_try': next_try,
+        }
+
+    def done(self, key, result):
+        data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._db.execute('INSERT INTO items (key, status, result, attempts, updated) VALUES (?, ?, ?, 1, ?) '
+                             'ON CONFLICT(key) DO UPDATE SET status = excluded.status, result = excluded.result, '
+                             'attempts = attempts + 1, error = NULL, next_try = NULL, updated = excluded.updated',
+                             (key, DONE, data, time.time()))
+
+    def failed(self, key, error) -> int:
+        """
+        Record a failed attempt
+        :return: int Amount of failed attempts so far
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT attempts FROM items WHERE key = ?', (key,)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            next_try = now + min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+            self._db.execute('INSERT OR REPLACE INTO items (key, status, attempts, error, next_try, updated) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', (key, FAILED, attempts, repr(error), next_try, now))
+        return attempts
+
+    def process(self, func, args, kwargs=None, key=None):
+        """
+        Call func(*args, **kwargs) unless the item is done already: the result (or failure) is stored, a failure is
+        retried after the back-off (at most `retries` times), the last exception is raised
+
+        :param key: str Key of the item, defaults to self.key(*args)
+        """
+        if key is None:
+            key = self.key(*args)
+        status = self.status(key)
+        if status is not None and status['status'] == DONE:
+            return status['result']
+        next_try = status['next_try'] if status is not None else None
+        for attempt in range(self.retries + 1):
+            if next_try is not None:
+                delay = next_try - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            try:
+                result = func(*args, **(kwargs or {}))
+            except Exception as e:
+                attempts = self.failed(key, e)
+                self.logger.debug('%s failed (attempt %d): %s', key, attempts, e)
+                if attempt >= self.retries:
+                    raise
+                next_try = self.status(key)['next_try']
+                continue
+            self.done(key, result)
+            return result
+
+    def results(self):
+        """Results of all done items"""
+        with self._lock:
+            rows = self._db.execute('SELECT result FROM items WHERE status = ?', (DONE,)).fetchall()
+        for row, in rows:
+            yield pickle.loads(row)
+
+    def stats(self) -> dict:
+        """Amount of items by status"""
+        with self._lock:
+            return dict(self._db.execute('SELECT status, COUNT(*) FROM items GROUP BY status ORDER BY status'))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+if __name__ == "__main__":
+    # run with `python3 -m pythonmodules.checkpoint` from parent directory
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,201 @@
+import heapq
+import os
+from .binarysearch import SortedBytesDirectory, SortedBytesMmapFile, EmptySortedBytes, read_sorted_bytes
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ChecksumIndex:
+    r"""
+    One sorted index over all files of a SortedBytesDirectory. Every record is the checksum followed by the id of
+    the file it came from (4 bytes, big endian, so records sort by checksum first), the ids point to the lines of
+    a `<filename>.files` table. Resolving a checksum costs one binary search instead of one per file.
+
+    >>> import tempfile
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> def write(name, ints):
+    ...     with open(os.path.join(tmp.name, name), 'wb') as f:
+    ...         _ = f.write(b''.join(sorted(i.to_bytes(4, 'little') for i in ints)))
+    >>> c = lambda i: i.to_bytes(4, 'little')
+    >>> write('a.crc', [1, 2, 3])
+    >>> write('b.crc', [3, 4])
+    >>> index = ChecksumIndex.build(tmp.name, os.path.join(tmp.name, 'all.idx'))
+    >>> len(index)
+    5
+    >>> sorted(os.path.basename(f) for f in index.lookup(c(3)))
+    ['a.crc', 'b.crc']
+    >>> index.lookup(c(5))
+    []
+    >>> [os.path.basename(f) for f in index.search([c(3), c(4)])]
+    ['b.crc']
+    >>> write('c.crc', [5, 3])
+    >>> [os.path.basename(f) for f in index.update(tmp.name)]
+    ['c.crc']
+    >>> [os.path.basename(f) for f in index.lookup(c(5))]
+    ['c.crc']
+    >>> sorted(os.path.basename(f) for f in ChecksumIndex(index.filename).lookup(c(3)))
+    ['a.crc', 'b.crc', 'c.crc']
+    >>> tmp.cleanup()
+    """
+    id_bytes = 4
+
+    def __init__(self, filename, nbytes=4):
+        """
+        :param filename: str Index file, the file table is stored next to it as `<filename>.files`
+        :param nbytes: int Size of the checksums
+        """
+        self.filename = filename
+        self._nbytes = nbytes
+        self._files = None
+
+    @property
+    def table_filename(self):
+        return self.filename + '.files'
+
+    @property
+    def record_size(self):
+        return self._nbytes + self.id_bytes
+
+    @property
+    def files(self) -> list:
+        if self._files is None:
+            if os.path.exists(self.table_filename):
+                with open(self.table_filename, 'r', encoding='utf-8') as f:
+                    self._files = f.read().splitlines()
+            else:
+                self._files = []
+        return self._files
+
+    def __len__(self):
+        if not os.path.exists(self.filename):
+            return 0
+        return os.stat(self.filename).st_size // self.record_size
+
+    def __repr__(self):
+        return '<%s %s[%d files]>' % (type(self).__name__, self.filename, len(self.files))
+
+    @classmethod
+    def build(cls, directory, filename, nbytes=4):
+        """
+        k-way merge all files of a directory into a new index
+
+        :param directory: str|SortedBytesDirectory
+        :return: ChecksumIndex
+        """
+        index = cls(filename, nbytes)
+        index._files = []
+        index._write_table([])
+        if os.path.exists(filename):
+            os.remove(filename)
+        index.update(directory)
+        return index
+
+    def update(self, directory) -> list:
+        """
+        Merge the files of the directory that aren't indexed yet into the index
+
+        :param directory: str|SortedBytesDirectory
+        :return: list The newly added files
+        """
+        if type(directory) is not SortedBytesDirectory:
+            directory = SortedBytesDirectory(directory)
+        known = set(self.files)
+        new_files = [file for file in directory.files() if file not in known]
+        if new_files:
+            self.add(new_files)
+        return new_files
+
+    def add(self, files):
+        """
+        Merge the given files into the index (streaming, existing records are read once)
+        """
+        if type(files) is str:
+            files = [files]
+        first_id = len(self.files)
+        streams = [self._records(file, first_id + i) for i, file in enumerate(files)]
+        if os.path.exists(self.filename):
+            streams.append(read_sorted_bytes(self.filename, self.record_size))
+
+        logger.debug('Merging %d files into %s', len(files), self.filename)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            buffer = []
+            for record in heapq.merge(*streams):
+                buffer.append(record)
+                if len(buffer) >= 65536:
+                    f.write(b''.join(buffer))
+                    buffer = []
+            f.write(b''.join(buffer))
+
+        # the table only grows, so write it first: an old index with a newer table is still consistent
+        self._write_table(self.files + list(files))
+        os.replace(tmp, self.filename)
+
+    def _records(self, file, file_id):
+        suffix = file_id.to_bytes(self.id_bytes, 'big')
+        return (checksum + suffix for checksum in read_sorted_bytes(file, self._nbytes))
+
+    def _write_table(self, files):
+        tmp = self.table_filename + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.writelines('%s\n' % file for file in files)
+        os.replace(tmp, self.table_filename)
+        self._files = list(files)
+
+    def _lookup_ids(self, reader, checksum):
+        # lower bound of checksum + smallest id, then walk over all records of this checksum
+        item = checksum + b'\x00' * self.id_bytes
+        start = 0
+        stop = len(reader)
+        while start < stop:
+            mid = (stop + start) // 2
+            if reader[mid] < item:
+                start = mid + 1
+            else:
+                stop = mid
+        ids = []
+        while start < len(reader):
+            record = reader[start]
+            if record[:self._nbytes] != checksum:
+                break
+            ids.append(int.from_bytes(record[self._nbytes:], 'big'))
+            start += 1
+        return ids
+
+    def _open(self):
+        if not os.path.exists(self.filename):
+            return EmptySortedBytes
+        return SortedBytesMmapFile(self.filename, self.record_size)
+
+    def lookup(self, checksum) -> list:
+        """
+        :return: list The files containing the checksum
+        """
+        if len(checksum) != self._nbytes:
+            raise KeyError("Expected length of %s" % self._nbytes)
+        with self._open() as reader:
+            return [self.files[i] for i in self._lookup_ids(reader, checksum)]
+
+    def search(self, checksums) -> list:
+        """
+        :return: list The files containing all of the checksums (like SortedBytesDirectory.search)
+        """
+        found = None
+        with self._open() as reader:
+            for checksum in checksums:
+                if len(checksum) != self._nbytes:
+                    raise KeyError("Expected length of %s" % self._nbytes)
+                ids = set(self._lookup_ids(reader, checksum))
+                found = ids if found is None else found & ids
+                if not found:
+                    return []
+        if found is None:
+            return list(self.files)
+        return [self.files[i] for i in sorted(found)]
+
+
+if __name__ == "__main__":
+    # run with `python3 -m pythonmodules.checksumindex` from parent directory
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,168 @@
+import heapq
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .binarysearch import read_sorted_bytes
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _items(source, nbytes):
+    """
+    Items of a source: a filename (unsorted file of nbytes records) or an iterable of bytes/ints
+    (ints are stored little endian, like Chunk.from_int)
+    """
+    if isinstance(source, (str, bytes, os.PathLike)):
+        yield from read_sorted_bytes(source, nbytes)
+        return
+    for item in source:
+        if type(item) is int:
+            item = item.to_bytes(nbytes, 'little')
+        elif len(item) != nbytes:
+            raise KeyError("Expected length of %s" % nbytes)
+        yield item
+
+
+def _chunks(sources, nbytes, chunk_items):
+    chunk = []
+    for source in sources:
+        for item in _items(source, nbytes):
+            chunk.append(item)
+            if len(chunk) >= chunk_items:
+                yield b''.join(chunk)
+                chunk = []
+    if chunk:
+        yield b''.join(chunk)
+
+
+def _sort_run(data, nbytes, filename):
+    """
+    Sort and deduplicate one chunk and write it as a run, runs in a worker process
+    """
+    items = sorted(set(data[i:i + nbytes] for i in range(0, len(data), nbytes)))
+    with open(filename, 'wb') as f:
+        f.write(b''.join(items))
+    return filename
+
+
+def _unique(items):
+    prev = None
+    for item in items:
+        if item != prev:
+            yield item
+            prev = item
+
+
+def _merge(runs, dst, nbytes):
+    count = 0
+    with open(dst, 'wb') as f:
+        buffer = []
+        for item in _unique(heapq.merge(*(read_sorted_bytes(run, nbytes) for run in runs))):
+            buffer.append(item)
+            if len(buffer) >= 65536:
+                f.write(b''.join(buffer))
+                count += len(buffer)
+                buffer = []
+        f.write(b''.join(buffer))
+        count += len(buffer)
+    return count
+
+
+def validate(filename, nbytes=4):
+    """
+    Check that a file is a valid sorted bytes file: size a multiple of nbytes, items sorted and unique
+
+    :return: int Amount of items
+    """
+    prev = None
+    count = 0
+    for item in read_sorted_bytes(filename, nbytes):
+        if prev is not None and item <= prev:
+            raise ValueError("%s: item %d is not greater than the previous one" % (filename, count))
+        prev = item
+        count += 1
+    return count
+
+
+def build(sources, dst, nbytes=4, chunk_items=4000000, processes=None, fan_in=64, tmpdir=None):
+    """
+    Build a sorted, deduplicated file (eg. .crc) from unsorted sources of any size with bounded memory: chunks
+    of `chunk_items` are sorted into runs by a process pool (at most `processes + 1` chunks in flight), the runs
+    are then k-way merged (in several passes if there are more than `fan_in`) and the result is validated.
+
+    :param sources: list Filenames of unsorted nbytes record files and/or iterables of bytes/ints
+    :param processes: int Worker processes for run generation, 0 to sort in the current process
+    :return: int Amount of unique items written
+
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> unsorted = os.path.join(tmp.name, 'unsorted.bin')
+    >>> with open(unsorted, 'wb') as f:
+    ...     _ = f.write(b''.join(i.to_bytes(4, 'little') for i in range(999, -1, -1)))
+    >>> dst = os.path.join(tmp.name, 'out.crc')
+    >>> build([unsorted, [5, 1000, 1001], iter([b'\\xff\\xff\\xff\\xff'])], dst, chunk_items=100, processes=2, fan_in=4)
+    1003
+    >>> validate(dst)
+    1003
+    >>> from .binarysearch import SortedBytesFile
+    >>> with SortedBytesFile(dst) as reader:
+    ...     all(i.to_bytes(4, 'little') in reader for i in range(1002))
+    True
+    >>> build([[b'\\x01\\x02']], dst, nbytes=2, processes=0), validate(dst, 2)
+    (1, 1)
+    >>> build([unsorted], dst, fan_in=1)
+    Traceback (most recent call last):
+    ...
+    ValueError: fan_in needs to be at least 2, got 1
+    >>> tmp.cleanup()
+    """
+    if fan_in < 2:
+        raise ValueError("fan_in needs to be at least 2, got %s" % fan_in)
+    if chunk_items < 1:
+        raise ValueError("chunk_items needs to be at least 1, got %s" % chunk_items)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    workdir = tempfile.mkdtemp(prefix='crcbuilder', dir=tmpdir)
+    try:
+        runs = []
+        chunks = _chunks(sources, nbytes, chunk_items)
+        if processes:
+            with ProcessPoolExecutor(processes) as pool:
+                pending = set()
+                for i, chunk in enumerate(chunks):
+                    if len(pending) > processes:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        runs.extend(future.result() for future in done)
+                    pending.add(pool.submit(_sort_run, chunk, nbytes, os.path.join(workdir, 'run%d' % i)))
+                runs.extend(future.result() for future in pending)
+        else:
+            runs = [_sort_run(chunk, nbytes, os.path.join(workdir, 'run%d' % i)) for i, chunk in enumerate(chunks)]
+        logger.debug('Generated %d runs', len(runs))
+
+        level = 0
+        while len(runs) > fan_in:
+            level += 1
+            merged = []
+            for i in range(0, len(runs), fan_in):
+                filename = os.path.join(workdir, 'merge%d_%d' % (level, i))
+                _merge(runs[i:i + fan_in], filename, nbytes)
+                for run in runs[i:i + fan_in]:
+                    os.remove(run)
+                merged.append(filename)
+            runs = merged
+
+        tmp = dst + '.tmp'
+        count = _merge(runs, tmp, nbytes)
+        if validate(tmp, nbytes) != count:
+            raise ValueError("Validation of %s failed" % tmp)
+        os.replace(tmp, dst)
+        return count
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # run with `python3 -m pythonmodules.crcbuilder` from parent directory
+    import doctest
+    doctest.testmod()
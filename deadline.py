@@ -0,0 +1,114 @@
+from contextvars import ContextVar
+import time
+
+_deadline = ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class deadline:
+    """Context manager to set an overall time budget for everything called within it. Nested deadlines can only
+    shorten the budget, never extend it. Backed by contextvars, so it follows the current thread/async task
+    (new threads start without a deadline).
+
+    Usage:
+
+        with deadline(30):
+            mh.get_alto(pid)
+
+    >>> remaining() is None
+    True
+    >>> with deadline(10):
+    ...     0 < remaining() <= 10
+    True
+    >>> with deadline(10):
+    ...     with deadline(60):
+    ...         remaining() <= 10
+    True
+    >>> with deadline(1):
+    ...     timeout(30) <= 1, timeout(.5)
+    (True, 0.5)
+    >>> timeout(30), timeout()
+    (30, None)
+    >>> with deadline(0):
+    ...     timeout(30)
+    Traceback (most recent call last):
+    ...
+    DeadlineExceeded: Deadline exceeded
+    """
+    def __init__(self, seconds):
+        """
+        :param seconds: float Time budget in seconds
+        """
+        self.seconds = seconds
+        self._token = None
+
+    def __enter__(self):
+        at = time.monotonic() + self.seconds
+        current = _deadline.get()
+        if current is not None and current < at:
+            at = current
+        self._token = _deadline.set(at)
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        _deadline.reset(self._token)
+        self._token = None
+
+
+def remaining():
+    """
+    Seconds left before the current deadline, None if there is no deadline
+    :return: float|None
+    """
+    at = _deadline.get()
+    if at is None:
+        return None
+    return at - time.monotonic()
+
+
+def expired():
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check(what=None):
+    """
+    Raise DeadlineExceeded if the current deadline has passed
+    """
+    if expired():
+        raise DeadlineExceeded('Deadline exceeded' if what is None else 'Deadline exceeded: %s' % what)
+
+
+def timeout(default=None, what=None):
+    """
+    Shorten a timeout to what's left of the current deadline
+    :param default: float|None The timeout that would be used without a deadline
+    :return: float|None
+    """
+    left = remaining()
+    if left is None:
+        return default
+    check(what)
+    if default is None or left < default:
+        return left
+    return default
+
+
+def sleep(seconds):
+    """
+    time.sleep that never sleeps past the current deadline (raises DeadlineExceeded instead)
+    """
+    left = remaining()
+    if left is not None and left < seconds:
+        time.sleep(max(0, left))
+        check()
+    time.sleep(seconds)
+
+
+if __name__ == '__main__':
+    # run with `python3 -m pythonmodules.deadline` from parent directory
+    import doctest
+    doctest.testmod()
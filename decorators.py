@@ -1,10 +1,14 @@
 import logging
 
 from .cache import LocalCacher
-from functools import partial
+from . import deadline
+from functools import partial, wraps
+from collections import deque
+from threading import Lock
 import time
 
-_log = logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
+_log = logger
 # _log.propagate = True
 _log.setLevel(logging.WARNING)
 _log = _log.debug
@@ -38,6 +42,8 @@ def log_call(logger: logging.Logger, log_level=logging.DEBUG, result=False):
     """
     def _log_call(func: callable):
         def _(*args, **kwargs):
+            if not logger.isEnabledFor(log_level):
+                return func(*args, **kwargs)
             logger.log(log_level, '%s(%s, %s)',
                        func.__name__,
                        ', '.join([str(a) for a in args]),
@@ -182,6 +188,14 @@ def retry(tries=5, logger=None, sleep=None):
     Traceback (most recent call last):
     ...
     Exception: nope
+    >>> @retry(5, sleep=.05)
+    ... def b():
+    ...     raise Exception("nope")
+    >>> with deadline.deadline(.08):
+    ...     b() # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    DeadlineExceeded: Deadline exceeded
     """
     def _(f):
         def _decorator(*args, **kwargs):
@@ -189,17 +203,227 @@ def retry(tries=5, logger=None, sleep=None):
             for i in range(tries):
                 try:
                     return func()
+                except CircuitBreakerOpenError:
+                    raise
                 except Exception as e:
                     if logger:
                         logger.exception(e)
-                    if i + 1 == tries:
+                    if i + 1 == tries or deadline.expired():
                         raise e
                     if sleep is not None:
-                        time.sleep(sleep)
+                        deadline.sleep(sleep)
         return _decorator
     return _
 
 
+class CircuitBreakerOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Keeps track of the outcome of the last calls to a remote service and stops calling it (fails fast) when too
+    many of them failed.
+
+    States:
+      - closed: calls pass through, outcomes are recorded
+      - open: calls fail immediately with CircuitBreakerOpenError until `cooldown` seconds have passed
+      - half-open: a limited amount of trial calls pass through, success closes the circuit, failure re-opens it
+
+    >>> breaker = CircuitBreaker('test', failure_rate=.5, window=4, min_calls=4, cooldown=.05)
+    >>> breaker.state
+    'closed'
+    >>> for success in (True, False, True, False):
+    ...     breaker.record(success)
+    >>> breaker.state
+    'open'
+    >>> breaker.allow()
+    False
+    >>> time.sleep(.06)
+    >>> breaker.state
+    'half-open'
+    >>> breaker.allow(), breaker.allow()
+    (True, False)
+    >>> breaker.record(True)
+    >>> breaker.state
+    'closed'
+    >>> sorted(breaker.stats().keys())
+    ['calls', 'failure_rate', 'failures', 'name', 'opened', 'rejected', 'state']
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    registry = {}
+
+    def __init__(self, name, failure_rate=.5, window=20, min_calls=5, cooldown=30, half_open_calls=1):
+        """
+        :param name: str Name used for logging and in the registry (`CircuitBreaker.registry`)
+        :param failure_rate: float Fraction of failed calls within the window that opens the circuit
+        :param window: int Amount of most recent calls taken into account
+        :param min_calls: int Minimum amount of recorded calls before the circuit can open
+        :param cooldown: float Seconds to stay open before allowing trial calls
+        :param half_open_calls: int Amount of concurrent trial calls allowed while half-open
+        """
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.half_open_calls = half_open_calls
+        self._outcomes = deque(maxlen=window)
+        self._lock = Lock()
+        self._state = CircuitBreaker.CLOSED
+        self._opened_at = None
+        self._trials = 0
+        self._counters = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+        CircuitBreaker.registry[name] = self
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == CircuitBreaker.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            self._state = CircuitBreaker.HALF_OPEN
+            self._trials = 0
+        return self._state
+
+    def _open(self):
+        self._state = CircuitBreaker.OPEN
+        self._opened_at = time.monotonic()
+        self._counters['opened'] += 1
+        logger.warning('Circuit breaker "%s" opened for %ss', self.name, self.cooldown)
+
+    def allow(self):
+        """
+        Whether a call is allowed to go through right now
+        :return: bool
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CircuitBreaker.CLOSED:
+                return True
+            if state == CircuitBreaker.HALF_OPEN and self._trials < self.half_open_calls:
+                self._trials += 1
+                return True
+            self._counters['rejected'] += 1
+            return False
+
+    def record(self, success):
+        """
+        Record the outcome of an allowed call
+        :param success: bool
+        """
+        with self._lock:
+            self._counters['calls'] += 1
+            if not success:
+                self._counters['failures'] += 1
+            state = self._current_state()
+            if state == CircuitBreaker.HALF_OPEN:
+                if success:
+                    self._state = CircuitBreaker.CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open()
+                return
+            self._outcomes.append(success)
+            if state == CircuitBreaker.CLOSED and len(self._outcomes) >= self.min_calls and \
+                    self._rate() >= self.failure_rate:
+                self._open()
+
+    def _rate(self):
+        if not self._outcomes:
+            return 0.
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def reset(self):
+        with self._lock:
+            self._state = CircuitBreaker.CLOSED
+            self._outcomes.clear()
+
+    def stats(self) -> dict:
+        """
+        Current state and counters, eg. to export as metrics
+        """
+        with self._lock:
+            stats = dict(self._counters, name=self.name, state=self._current_state(), failure_rate=self._rate())
+        return stats
+
+    def __call__(self, func, exceptions=Exception):
+        @wraps(func)
+        def _(*args, **kwargs):
+            if not self.allow():
+                raise CircuitBreakerOpenError('Circuit breaker "%s" is open, not calling %s' %
+                                              (self.name, func.__name__))
+            try:
+                result = func(*args, **kwargs)
+            except deadline.DeadlineExceeded:
+                # our own time budget ran out, says nothing about the remote end
+                self.release()
+                raise
+            except exceptions:
+                self.record(False)
+                raise
+            except Exception:
+                # the remote end did answer, just not in a way we liked
+                self.record(True)
+                raise
+            except BaseException:
+                self.release()
+                raise
+            self.record(True)
+            return result
+        _._circuit_breaker = self
+        return _
+
+    def release(self):
+        """
+        Give back a trial call slot without recording an outcome
+        """
+        with self._lock:
+            if self._state == CircuitBreaker.HALF_OPEN and self._trials > 0:
+                self._trials -= 1
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (type(self).__name__, self.name, self.state)
+
+
+def circuit_breaker(name=None, exceptions=Exception, **kwargs):
+    """
+    Decorator to fail fast when the decorated (remote) call keeps failing, see CircuitBreaker for the arguments.
+    Only exceptions of type `exceptions` count as failures, the breaker is reachable through `func._circuit_breaker`
+
+    >>> calls = 0
+    >>> @circuit_breaker('doctest', exceptions=IOError, window=2, min_calls=2, cooldown=60)
+    ... def remote(fail=True):
+    ...     global calls
+    ...     calls += 1
+    ...     if fail:
+    ...         raise IOError('down')
+    ...     return 'up'
+    >>> remote(False)
+    'up'
+    >>> remote()
+    Traceback (most recent call last):
+    ...
+    OSError: down
+    >>> remote._circuit_breaker.state
+    'open'
+    >>> remote(False)
+    Traceback (most recent call last):
+    ...
+    CircuitBreakerOpenError: Circuit breaker "doctest" is open, not calling remote
+    >>> calls
+    2
+    >>> CircuitBreaker.registry['doctest'] is remote._circuit_breaker
+    True
+    """
+    def _decorator(func):
+        return CircuitBreaker(func.__qualname__ if name is None else name, **kwargs)(func, exceptions=exceptions)
+    return _decorator
+
+
 if __name__ == '__main__':
     # run with `python3 -m pythonmodules.decorators` from parent directory
     import doctest
@@ -0,0 +1,168 @@
+import mmap
+import os
+import random
+import struct
+import tempfile
+import time
+from .binarysearch import ASortedBytes, EmptySortedBytes, SortedBytesMmapFile, read_sorted_bytes
+
+import logging
+logger = logging.getLogger(__name__)
+
+MAGIC = b'EYTZ'
+VERSION = 1
+HEADER = struct.Struct('<4sHHQ')
+
+
+def eytzinger_order(n):
+    """
+    Positions (in the sorted input) of the items in Eytzinger (BFS) order, ie. the implicit binary search tree
+    where the children of node k are 2k and 2k + 1 (1-based)
+
+    >>> list(eytzinger_order(7))
+    [3, 1, 5, 0, 2, 4, 6]
+    >>> list(eytzinger_order(0))
+    []
+    """
+    order = [0] * n
+    i = 0
+    # iterative in-order walk of the implicit tree, assigning sorted positions in order
+    stack = []
+    k = 1
+    while stack or k <= n:
+        while k <= n:
+            stack.append(k)
+            k *= 2
+        k = stack.pop()
+        order[k - 1] = i
+        i += 1
+        k = 2 * k + 1
+    return order
+
+
+def convert(src, dst, nbytes=4):
+    """
+    Convert a sorted bytes file (eg. .crc) to the Eytzinger layout. Needs the items of one file in memory.
+    """
+    items = list(read_sorted_bytes(src, nbytes))
+    tmp = dst + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, nbytes, len(items)))
+        f.write(b''.join(items[i] for i in eytzinger_order(len(items))))
+    os.replace(tmp, dst)
+
+
+class EytzingerFile(ASortedBytes):
+    r"""
+    Reader for files written by `convert`. The top levels of the search tree are stored next to each other, so the
+    first probes of every lookup hit the same few (cached) pages instead of log2(n) scattered ones.
+    Can be used as `reader` for SortedBytesDirectory (with a matching suffix).
+
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> src, dst = os.path.join(tmp.name, 'a.crc'), os.path.join(tmp.name, 'a.eytz')
+    >>> with open(src, 'wb') as f:
+    ...     _ = f.write(b''.join(sorted(i.to_bytes(4, 'little') for i in range(0, 1000, 3))))
+    >>> convert(src, dst)
+    >>> with EytzingerFile(dst) as reader:
+    ...     print(len(reader), (999).to_bytes(4, 'little') in reader, (998).to_bytes(4, 'little') in reader)
+    ...     print(all(i.to_bytes(4, 'little') in reader for i in range(0, 1000, 3)))
+    ...     print(any(i.to_bytes(4, 'little') in reader for i in range(1, 1000, 3)))
+    334 True False
+    True
+    False
+    >>> with open(dst, 'r+b') as f:
+    ...     _ = f.write(b'NOPE')
+    >>> EytzingerFile(dst).__enter__()
+    Traceback (most recent call last):
+    ...
+    ValueError: Not an Eytzinger file (magic b'NOPE')
+    >>> tmp.cleanup()
+    """
+    def __init__(self, filename, nbytes=4):
+        self._filename = filename
+        self._nbytes = nbytes
+        self._len = 0
+        self._mmap = None
+
+    def __enter__(self):
+        with open(self._filename, 'rb') as file:
+            header = file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise EOFError("File too short for header")
+            magic, version, nbytes, count = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError("Not an Eytzinger file (magic %a)" % magic)
+            if version != VERSION:
+                raise ValueError("Unsupported Eytzinger version %d" % version)
+            if nbytes != self._nbytes:
+                raise KeyError("File has items of %dB, expected %dB" % (nbytes, self._nbytes))
+            if os.fstat(file.fileno()).st_size != HEADER.size + count * nbytes:
+                raise EOFError("Expected %d items of %dB" % (count, nbytes))
+            if count == 0:
+                return EmptySortedBytes()
+            self._len = count
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, item):
+        """
+        Item at position `item` of the tree (BFS order, not sorted order!)
+        """
+        item = self._index(item)
+        offset = HEADER.size + item * self._nbytes
+        return self._mmap[offset:offset + self._nbytes]
+
+    def __contains__(self, item):
+        self.assert_valid_item(item)
+        data = self._mmap
+        n = self._nbytes
+        base = HEADER.size - n
+        k = 1
+        while k <= self._len:
+            offset = base + k * n
+            found = data[offset:offset + n]
+            if found == item:
+                return True
+            k = 2 * k + (found < item)
+        return False
+
+    def __repr__(self):
+        return '<%s %s[%d]>' % (type(self).__name__, self._filename, self._len)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._mmap:
+            self._mmap.close()
+            self._mmap = None
+
+
+def benchmark(n=1000000, queries=100000, nbytes=4, seed=0):
+    """
+    Compare lookups in the plain sorted layout with the Eytzinger layout on a synthetic file
+    :return: dict Seconds per lookup by reader
+    """
+    rnd = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'bench.crc')
+        dst = os.path.join(tmp, 'bench.eytz')
+        values = sorted(set(rnd.getrandbits(8 * nbytes).to_bytes(nbytes, 'little') for _ in range(n)))
+        with open(src, 'wb') as f:
+            f.write(b''.join(values))
+        convert(src, dst, nbytes)
+        keys = [rnd.getrandbits(8 * nbytes).to_bytes(nbytes, 'little') for _ in range(queries)]
+        results = {}
+        for name, reader in (('sorted', SortedBytesMmapFile(src, nbytes)), ('eytzinger', EytzingerFile(dst, nbytes))):
+            with reader as r:
+                start = time.perf_counter()
+                for key in keys:
+                    _ = key in r
+                results[name] = (time.perf_counter() - start) / queries
+    return results
+
+
+if __name__ == "__main__":
+    # run with `python3 -m pythonmodules.eytzinger` from parent directory
+    import doctest
+    doctest.testmod()
@@ -12,10 +12,10 @@ import logging
 import http.client as http_client
 import urllib3
 from urllib.parse import quote_plus, urlparse, ParseResult
-import time
 from . import alto
 from .config import Config
 from . import decorators
+from . import deadline
 from .cache import OptimizedFileCacher
 from PIL import Image, ImageDraw
 from io import BytesIO
@@ -26,6 +26,7 @@ from time import sleep
 from datetime import datetime
 import email.utils as rfc5322
 from .alto import Extent
+from .multithreading import batched
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +43,15 @@ def _remove_auth_from_url(url):
     return replaced.geturl()
 
 
+def _quote(value):
+    """
+    Quote a value for use in a search query, so spaces, colons and query operators in it are taken literally
+    :param value: str
+    :return: string
+    """
+    return '"%s"' % str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
 class MediaHavenException(Exception):
     pass
 
@@ -50,6 +60,10 @@ class MediaHavenTimeoutException(MediaHavenException):
     pass
 
 
+class MediaHavenServerException(MediaHavenException):
+    pass
+
+
 def too_many_req_decorator(sleeptime=1):
     def _decorator(func):
         def new_func(*args, **kwargs):
@@ -57,6 +71,10 @@ def too_many_req_decorator(sleeptime=1):
             attempts = 5
             while attempts > 0 and r is not None and r.status_code == 429:
                 attempts -= 1
+                left = deadline.remaining()
+                if left is not None and left < sleeptime:
+                    logger.info('Too many req, but no time left before the deadline to retry')
+                    break
 
                 logger.info('Too many req, sleeping for %d secs and retrying another %d times', sleeptime, attempts)
 
@@ -164,7 +182,7 @@ class MediaHaven:
         r = req.post('%s%s' % (_remove_auth_from_url(self.url), '/resources/oauth/access_token'),
                      auth=(self.url.username, self.url.password),
                      data={'grant_type': 'password'},
-                     timeout=self.timeout)
+                     timeout=deadline.timeout(self.timeout))
         self._validate_response(r)
         self.token = r.json()
         self.tokenText = self.token['token_type'] + ' ' + self.token['access_token']
@@ -177,12 +195,15 @@ class MediaHaven:
 
         if r.status_code < 200 or r.status_code >= 300:
             # logger.warning("Wrong status code %d: %s ", r.status_code, r.text)
-            raise MediaHavenException("Wrong status code %d (for user '%s'): \n%s\n\n%s" %
+            exception_class = MediaHavenServerException if r.status_code >= 500 else MediaHavenException
+            raise exception_class("Wrong status code %d (for user '%s'): \n%s\n\n%s" %
                                       (r.status_code,
                                        self.url.username,
                                        "\n".join("%s: %s" % (k, v) for k, v in r.headers.items()),
                                        r.text))
 
+    @decorators.circuit_breaker('mediahaven', exceptions=(MediaHavenTimeoutException, MediaHavenServerException,
+                                                          requests.exceptions.ConnectionError))
     def call_absolute(self, url, params=None, method=None, raw_response=False):
         if method is None:
             method = 'get'
@@ -190,10 +211,18 @@ class MediaHaven:
         def do_call():
             if not self.tokenText:
                 self.refresh_token()
-            res = getattr(req, method)(url,
-                                       headers={'Authorization': self.tokenText},
-                                       timeout=self.timeout,
-                                       params=params)
+            timeout = deadline.timeout(self.timeout, url)
+            try:
+                res = getattr(req, method)(url,
+                                           headers={'Authorization': self.tokenText},
+                                           timeout=timeout,
+                                           params=params)
+            except (MediaHavenTimeoutException, requests.exceptions.Timeout) as e:
+                if timeout is not None and (self.timeout is None or timeout < self.timeout):
+                    # the timeout was cut short by the caller's deadline: not a failure of the server (so it
+                    # doesn't count for the circuit breaker)
+                    raise deadline.DeadlineExceeded('Deadline exceeded: %s' % url) from e
+                raise
             logger.debug("HTTP %s %s with params %s returns status code %d", method, url, params, res.status_code)
             return res
 
@@ -238,6 +267,17 @@ class MediaHaven:
             return None
         return MediaObject(res['mediaDataList'][0], q)
 
+    @batched(max_size=25, class_method_with_self=True)
+    def one_by_external_id(self, external_ids):
+        """Get the media object for an externalId (or None): called with a single externalId, concurrent calls are
+        combined into one search query for all of their externalIds
+        """
+        q = '+(%s)' % ' '.join('externalId:%s' % _quote(external_id) for external_id in external_ids)
+        results = {}
+        for item in self.search(q, nr_of_results=len(external_ids)):
+            results.setdefault(item['externalId'], item)
+        return results
+
     def search(self, q, start_index=0, nr_of_results=None):
         """Execute a mediahaven search query
         """
@@ -293,11 +333,12 @@ class MediaHaven:
         export = self.export(media_object_id)
         if max_timeout is None:
             max_timeout = 15
-        repeats = max_timeout * 10
+        max_timeout = deadline.timeout(max_timeout)
+        repeats = int(max_timeout * 10)
         logger.debug("Get export for %s", media_object_id)
         while repeats > 0 and not export.is_ready():
             repeats -= 1
-            time.sleep(0.1)
+            deadline.sleep(0.1)
 
         if not export.is_ready():
             msg = "Timeout of %ds reached without export being ready for '%s'" % (max_timeout, export.location)
@@ -317,7 +358,7 @@ class MediaHaven:
             data = pid
             pid = pid['externalId']
         else:
-            data = self.one('+(externalId:%s)' % pid)
+            data = self.one_by_external_id(pid)
             if data is None:
                 logger.warning('Could not find externalId %s', pid)
         cp = None
@@ -343,7 +384,7 @@ class MediaHaven:
                 file = attempts[attempt-1]()
                 if file is not None:
                     # logger.debug('get_alto: Attempt %d: %s', attempt, file)
-                    result = req.get(file, timeout=self.timeout)
+                    result = req.get(file, timeout=deadline.timeout(self.timeout))
                 else:
                     raise MediaHavenException('Couldnt get URL (result = None)')
                 if result.status_code != requests.codes.ok:
@@ -354,6 +395,8 @@ class MediaHaven:
                 return alto.AltoRoot(result.content, file)
             except MediaHavenException as e:
                 logger.warning(e)
+            except deadline.DeadlineExceeded:
+                raise
             except Exception as e:
                 logger.exception(e)
         raise MediaHavenException("Could not load alto file after %d attempts" % attempt)
@@ -449,12 +492,12 @@ class PreviewImage:
         if not self.closed:
             raise IOError("File already open")
 
-        item = self.mh.one('+(externalId:%s)' % self.pid)
+        item = self.mh.one_by_external_id(self.pid)
         self.closed = False
-        if len(item) == 0:
+        if not item:
             return None
         self.meta = item
-        self.image = Image.open(BytesIO(req.get(self.meta['previewImagePath']).content))
+        self.image = Image.open(BytesIO(req.get(self.meta['previewImagePath'], timeout=deadline.timeout()).content))
         return self
 
     def close(self):
@@ -586,7 +629,7 @@ class Export:
 
         data = []
         for file in files:
-            res = req.get(file)
+            res = req.get(file, timeout=deadline.timeout(self.mh.timeout))
             if res.status_code != requests.codes.ok:
                 raise MediaHavenException("Invalid status code %d" % res.status_code)
             data.append(res.content)
@@ -1,13 +1,34 @@
-from queue import Queue
-from threading import Thread
-from functools import partial
+from queue import Queue, Empty
+from threading import Thread, Lock, Condition
+from functools import partial, wraps
 from itertools import chain
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import Future
 from pythonmodules.null import Null
+import asyncio
+import importlib
+import multiprocessing
+import multiprocessing.util
+import os
+import pickle
+import time
 
 import logging
 logger = logging.getLogger(__name__)
 
 
+_STOP = object()
+
+
+class _Call:
+    """Arguments of one run or imap call, shared by its queued tasks"""
+    def __init__(self, args=(), kwargs=None):
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.cancelled = False
+
+
 class MultiThreadError(BaseException):
     pass
 
@@ -16,9 +37,158 @@ class AlreadyRunningError(MultiThreadError):
     pass
 
 
+class BatchError(Exception):
+    pass
+
+
+class ThrottledError(Exception):
+    """
+    Raised by a processor when the service it calls asks to slow down (eg. HTTP 429). With an adaptive MultiThread
+    the amount of active workers is cut and the item is retried after `retry_after` seconds (or a back-off).
+    """
+    def __init__(self, *args, retry_after=None):
+        super().__init__(*args)
+        self.retry_after = retry_after
+
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _windowed(iterable, submit, out, window, ordered):
+    """
+    Submit the items of iterable as `submit(index, item)` while less than `window` of them are pending, and yield
+    the results that come in on the `out` queue as (index, result) tuples
+    """
+    done = {}
+    it = iter(iterable)
+    submitted = consumed = 0
+    exhausted = False
+    while True:
+        while not exhausted and submitted - consumed < window:
+            try:
+                item = next(it)
+            except StopIteration:
+                exhausted = True
+                break
+            submit(submitted, item)
+            submitted += 1
+        if submitted == consumed and exhausted:
+            return
+        index, result = out.get()
+        if not ordered:
+            consumed += 1
+            yield result
+            continue
+        done[index] = result
+        while consumed in done:
+            yield done.pop(consumed)
+            consumed += 1
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD controller for the amount of active workers: every `interval` seconds the limit grows by one, unless calls
+    were throttled, the error rate exceeded `max_error_rate` or the mean latency rose above `latency_factor` times
+    the lowest mean latency seen, then the limit is multiplied by `decrease`. Workers with a thread_id at or above
+    the limit wait until it grows again.
+
+    >>> c = AdaptiveConcurrency(min_workers=2, max_workers=10, interval=0)
+    >>> c.limit
+    2
+    >>> for _ in range(3):
+    ...     c.record(.1)
+    >>> c.limit
+    5
+    >>> c.record(.1, throttled=True)
+    >>> c.limit
+    2
+    >>> c.record(.5)
+    >>> c.limit
+    2
+    >>> sorted(c.stats())
+    ['errors', 'latency', 'limit', 'min_latency', 'throttled', 'throughput']
+    """
+    def __init__(self, min_workers=1, max_workers=None, interval=1., decrease=.5, max_error_rate=.1,
+                 latency_factor=2.):
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.decrease = decrease
+        self.max_error_rate = max_error_rate
+        self.latency_factor = latency_factor
+        self.limit = min_workers
+        self.min_latency = None
+        self._stopping = False
+        self._last = {}
+        self._reset_window()
+        self._cond = Condition()
+
+    def _reset_window(self):
+        self._start = time.monotonic()
+        self._calls = self._errors = self._throttled = 0
+        self._latency = 0.
+
+    def record(self, latency, error=False, throttled=False):
+        with self._cond:
+            self._calls += 1
+            self._latency += latency
+            self._errors += error
+            self._throttled += throttled
+            if time.monotonic() - self._start >= self.interval:
+                self._adjust()
+
+    def _adjust(self):
+        elapsed = time.monotonic() - self._start
+        latency = self._latency / self._calls
+        self._last = {
+            'throughput': self._calls / elapsed if elapsed else None,
+            'latency': latency,
+            'errors': self._errors,
+            'throttled': self._throttled,
+        }
+        slow = self.min_latency is not None and latency > self.latency_factor * self.min_latency
+        if self._throttled or self._errors > self.max_error_rate * self._calls or slow:
+            limit = max(self.min_workers, int(self.limit * self.decrease))
+        else:
+            limit = self.limit + 1
+            if self.max_workers is not None:
+                limit = min(self.max_workers, limit)
+        if not self._throttled and not self._errors and (self.min_latency is None or latency < self.min_latency):
+            self.min_latency = latency
+        if limit != self.limit:
+            logger.debug('Adaptive concurrency %d => %d (%s)', self.limit, limit, self._last)
+            self.limit = limit
+            self._cond.notify_all()
+        self._reset_window()
+
+    def wait_turn(self, thread_id):
+        """Block while thread_id is not within the limit"""
+        with self._cond:
+            self._cond.wait_for(lambda: thread_id < self.limit or self._stopping)
+
+    def stop(self, stopping=True):
+        """(Un)block all waiting workers, eg. to let them see the shutdown sentinels"""
+        with self._cond:
+            self._stopping = stopping
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return dict(self._last, limit=self.limit, min_latency=self.min_latency)
+
+
 class MultiThread:
     """
-    Simple wrapper class for basic multithreading
+    Simple wrapper class for basic multithreading. The worker threads are started on the first run and reused by
+    the next ones, until `shutdown()` (or leaving the `with` block) stops them.
 
     >>> from collections import namedtuple
     >>> def noop(*args, **kwargs):
@@ -85,8 +255,136 @@ class MultiThread:
     <__main__.MultiThread object at 0x...>
     >>> t.result
     ['before', 'after']
+    >>> import threading
+    >>> before = threading.active_count()
+    >>> with MultiThread(refl, n_workers=4) as t:
+    ...     for _ in range(5):
+    ...         t.extend(range(10))
+    ...         _ = t.run()
+    ...     print(t.workers, threading.active_count() - before)
+    4 4
+    >>> t.workers, threading.active_count() - before
+    (0, 0)
+    >>> def slow_square(n, **kwargs):
+    ...     sleep(.001 * (n % 3))
+    ...     return n * n if n != 4 else None
+    >>> t = MultiThread(slow_square, n_workers=4)
+    >>> list(t.imap(range(10)))
+    [0, 1, 4, 9, 25, 36, 49, 64, 81]
+    >>> sorted(t.imap_unordered(iter(range(10)), window=2))
+    [0, 1, 4, 9, 25, 36, 49, 64, 81]
+    >>> def numbers():
+    ...     global taken
+    ...     for taken in range(1000000):
+    ...         yield taken
+    >>> results = t.imap(numbers(), window=8)
+    >>> next(results), next(results), taken < 16
+    (0, 1, True)
+    >>> results.close()
+    >>> t.running
+    False
+    >>> def tag(prefix, n, **kwargs):
+    ...     sleep(.001)
+    ...     return prefix, n
+    >>> t = MultiThread(tag, n_workers=2)
+    >>> results = t.imap(range(100), 'first', window=20)
+    >>> next(results)
+    ('first', 0)
+    >>> results.close()
+    >>> t.extend(range(3))
+    >>> sorted(t.run('second'))
+    [('second', 0), ('second', 1), ('second', 2)]
+    >>> class Progress:
+    ...     updates = []
+    ...     def update(self, n):
+    ...         self.updates.append(n)
+    >>> t = MultiThread(slow_square, n_workers=2, chunksize=4, pbar=Progress())
+    >>> t.extend(range(10))
+    >>> sorted(t.run())
+    [0, 1, 4, 9, 25, 36, 49, 64, 81]
+    >>> sorted(t.pbar.updates)
+    [2, 4, 4]
+    >>> list(t.imap(range(10), window=1))
+    [0, 1, 4, 9, 25, 36, 49, 64, 81]
+    >>> concurrent = []
+    >>> lock = Lock()
+    >>> def rate_limited(n, thread_id):
+    ...     with lock:
+    ...         concurrent.append(n)
+    ...     try:
+    ...         if len(concurrent) > 4:
+    ...             raise ThrottledError('429 Too Many Requests', retry_after=.01)
+    ...         sleep(.005)
+    ...         return n
+    ...     finally:
+    ...         with lock:
+    ...             concurrent.remove(n)
+    >>> control = AdaptiveConcurrency(min_workers=1, max_workers=16, interval=.02)
+    >>> with MultiThread(rate_limited, n_workers=16, adaptive=control) as t:
+    ...     t.extend(range(300))
+    ...     sorted(t.run()) == list(range(300))
+    True
+    >>> 1 <= control.limit <= 8
+    True
+    >>> t = MultiThread(slow_square, n_workers=4, adaptive=AdaptiveConcurrency(max_workers=1, interval=60))
+    >>> t.extend(range(10))
+    >>> len(t.run()), t.workers
+    (9, 4)
+    >>> t.shutdown(wait=False)
+    >>> t.extend(range(10))
+    >>> len(t.run()), t.workers
+    (9, 4)
+    >>> t.shutdown()
+    >>> t.workers, t.adaptive._stopping
+    (0, False)
+    >>> sessions, opened = [], []
+    >>> def open_session(name):
+    ...     session = object()
+    ...     sessions.append(session)
+    ...     opened.append(session)
+    ...     return session
+    >>> def fetch(n, resource):
+    ...     return resource
+    >>> with MultiThread(fetch, n_workers=2, pass_thread_id=False, initializer=open_session, initargs=('session',),
+    ...                  finalizer=sessions.remove) as t:
+    ...     for _ in range(3):
+    ...         t.extend(range(10))
+    ...         print(set(t.run()) <= set(opened))
+    True
+    True
+    True
+    >>> len(opened), sessions
+    (2, [])
+    >>> def connect(failures):
+    ...     if failures:
+    ...         raise ConnectionError('database unavailable (%d)' % failures.pop())
+    ...     return 'connection'
+    >>> t = MultiThread(fetch, n_workers=1, pass_thread_id=False, initializer=connect, initargs=([1],))
+    >>> t.extend(range(10))
+    >>> t.run()
+    Traceback (most recent call last):
+    ...
+    ConnectionError: database unavailable (1)
+    >>> t.workers, t.running
+    (0, False)
+    >>> t.extend(range(10))
+    >>> t.run() == ['connection'] * 10
+    True
     """
-    def __init__(self, processor=None, n_workers=5, queue_buffer_size=None, pbar=None, pass_thread_id=True):
+    def __init__(self, processor=None, n_workers=5, queue_buffer_size=None, pbar=None, pass_thread_id=True,
+                 chunksize=1, adaptive=None, initializer=None, initargs=(), finalizer=None, checkpoint=None):
+        """
+        :param chunksize: int Amount of items a worker takes from the queue at once, results and progress are
+                          updated once per chunk. Amortizes the queue overhead when the items are tiny.
+        :param adaptive: AdaptiveConcurrency|bool Let the amount of active workers (at most n_workers) follow the
+                         observed latency, errors and ThrottledErrors of the processor
+        :param initializer: callable Called with `initargs` once in every worker thread, what it returns (eg. a
+                            requests.Session) is passed to the processor as the `resource` kwarg. If it fails the
+                            worker fails its items and the run raises the exception.
+        :param finalizer: callable Called with the resource when a worker thread stops (see shutdown)
+        :param checkpoint: checkpoint.CheckpointStore Skip the items it has as done (their stored result is
+                           used), record results and failures, retry failed items with back-off
+        """
         self.processor = processor
         if queue_buffer_size is None:
             queue_buffer_size = 0
@@ -95,77 +393,315 @@ class MultiThread:
         self.pbar = pbar
         self.logger = logger
         self.result = None
+        self.errors = 0
         self.pass_thread_id = pass_thread_id
+        self.chunksize = chunksize
+        if adaptive is True:
+            adaptive = AdaptiveConcurrency(max_workers=n_workers)
+        self.adaptive = adaptive or None
+        self.initializer = initializer
+        self.initargs = initargs
+        self.finalizer = finalizer
+        self.checkpoint = checkpoint
+        self._chunk = []
+        self._threads = []
+        self._retired = []
+        self._stopping = 0
+        self._initializer_error = None
+        self._current = _Call()
+        self._pool_lock = Lock()
+        self._result_lock = Lock()
+        self._chunk_lock = Lock()
 
-    def _worker(self, *args, **kwargs):
-        self.logger.info('Worker started')
-        processor = partial(self.processor, *args, **kwargs)
-        while True:
-            args = self.q.get()
-            result = None
+    def _worker(self, thread_id):
+        self.logger.info('Worker %d started', thread_id)
+        resource = error = None
+        if self.initializer is not None:
             try:
-                result = processor(*args)
+                resource = self.initializer(*self.initargs)
             except Exception as e:
-                if self.logger:
+                self.logger.exception(e)
+                error = e
+                self._failed_initializer(error, 0)
+        try:
+            self._work(thread_id, resource, error)
+        finally:
+            if self.finalizer is not None and error is None:
+                try:
+                    self.finalizer(resource)
+                except Exception as e:
                     self.logger.exception(e)
+        self.logger.info('Worker %d stopped', thread_id)
+
+    def _work(self, thread_id, resource, error=None):
+        while True:
+            if self.adaptive is not None:
+                self.adaptive.wait_turn(thread_id)
+            task = self.q.get()
+            if task is _STOP:
+                if self.adaptive is not None:
+                    self._stopped()
+                self.q.task_done()
+                return
+            rows, out, index, call = task
+            if call.cancelled:
+                self.q.task_done()
+                continue
+            if error is not None:
+                # without its resource this worker fails its items, the run raises the initializer's exception
+                results = self._failed_initializer(error, len(rows))
+            else:
+                kwargs = call.kwargs
+                if self.pass_thread_id:
+                    kwargs = dict(kwargs, thread_id=thread_id)
+                if self.initializer is not None:
+                    kwargs = dict(kwargs, resource=resource)
+                processor = partial(self.processor, *call.args)
+                results = []
+                for args in rows:
+                    results.append(self._process(processor, args, kwargs))
 
-            if result is not None:
-                self.result.append(result)
+            if out is not None:
+                out.put((index, results))
+            else:
+                self._collect(results)
             self.q.task_done()
             if self.pbar is not None:
-                self.pbar.update(1)
+                self.pbar.update(len(rows))
+
+    def _process(self, processor, args, kwargs):
+        try:
+            if self.checkpoint is not None:
+                return self.checkpoint.process(partial(self._call, processor), args, kwargs)
+            return self._call(processor, *args, **kwargs)
+        except Exception as e:
+            self._count_error()
+            if self.logger:
+                self.logger.exception(e)
+
+    def _call(self, processor, *args, **kwargs):
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                result = processor(*args, **kwargs)
+            except ThrottledError as e:
+                self._record(start, throttled=True)
+                attempt += 1
+                if self.adaptive is None or attempt > 10:
+                    raise
+                time.sleep(e.retry_after if e.retry_after is not None else min(30., .1 * 2 ** attempt))
+                continue
+            except Exception:
+                self._record(start, error=True)
+                raise
+            self._record(start)
+            return result
+
+    def _record(self, start, error=False, throttled=False):
+        if self.adaptive is not None:
+            self.adaptive.record(time.monotonic() - start, error, throttled)
+
+    def _count_error(self):
+        with self._result_lock:
+            self.errors += 1
+
+    def _failed_initializer(self, error, n):
+        with self._result_lock:
+            self.errors += n
+            if self._initializer_error is None:
+                self._initializer_error = error
+        return [None] * n
+
+    def _raise_initializer_error(self):
+        """
+        Raise the exception of a failed initializer (once), after stopping the pool: the next run starts new
+        workers, with new initializer calls
+        """
+        with self._result_lock:
+            error, self._initializer_error = self._initializer_error, None
+        if error is not None:
+            self.shutdown()
+            raise error
+
+    def _collect(self, results):
+        results = [result for result in results if result is not None]
+        if results:
+            with self._result_lock:
+                self.result.extend(results)
+
+    def _ensure_workers(self):
+        with self._pool_lock:
+            # the sentinels of a shutdown(wait=False) are meant for the old threads, not for the new ones
+            retired, self._retired = self._retired, []
+            for t in retired:
+                t.join()
+            for i in range(len(self._threads), self.n_workers):
+                t = Thread(target=self._worker, args=(i,), daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    @property
+    def workers(self) -> int:
+        """Amount of pool threads currently alive"""
+        return sum(t.is_alive() for t in self._threads)
+
+    def shutdown(self, wait=True):
+        """
+        Stop the pool threads once the queued items are processed. The pool is started again by a next run (which
+        first waits for the threads stopped without `wait`).
+        """
+        with self._pool_lock:
+            threads, self._threads = self._threads, []
+            if self.adaptive is not None and threads:
+                # wake the parked workers, the last one to take its sentinel lets the adaptive limit apply again
+                with self._result_lock:
+                    self._stopping += len(threads)
+                    self.adaptive.stop()
+            for _ in threads:
+                self.q.put(_STOP)
+            if not wait:
+                self._retired.extend(threads)
+        if wait:
+            for t in threads:
+                t.join()
+
+    def _stopped(self):
+        with self._result_lock:
+            self._stopping -= 1
+            if not self._stopping:
+                self.adaptive.stop(False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
 
     def append(self, *args):
         # self.logger.debug('Append 1 item to queue')
-        self.q.put(args)
+        if self.chunksize <= 1:
+            self.q.put(([args], None, None, self._current))
+            return
+        with self._chunk_lock:
+            self._chunk.append(args)
+            if len(self._chunk) < self.chunksize:
+                return
+            chunk, self._chunk = self._chunk, []
+        self.q.put((chunk, None, None, self._current))
+
+    def flush(self):
+        """Queue the items of an incomplete chunk"""
+        with self._chunk_lock:
+            chunk, self._chunk = self._chunk, []
+        if chunk:
+            self.q.put((chunk, None, None, self._current))
 
     def extend(self, iterable):
         for row in iterable:
             self.append(row)
 
     def wait(self):
+        """
+        Wait until all queued items are processed
+        :raises Exception: The exception of a failed initializer
+        """
+        self.flush()
         self.q.join()
+        self._raise_initializer_error()
         return self
 
     def start(self, *args, **kwargs):
         if self.running:
             raise AlreadyRunningError("Attempted to run while already running")
         self.result = []
+        # tasks appended before the start belong to this run too
+        self._current.args = args
+        self._current.kwargs = kwargs
         self.logger.debug('Starting threaded run, %d workers', self.n_workers)
-        for i in range(self.n_workers):
-            if self.pass_thread_id:
-                kwargs['thread_id'] = i
-            t = Thread(target=partial(self._worker, *args, **kwargs), daemon=True)
-            t.start()
+        self._ensure_workers()
 
     @property
     def running(self):
         return self.result is not None
 
+    def _finish(self):
+        result = self.result
+        self.result = None
+        self._current = _Call()
+        return result
+
     def run_with_iter(self, iterable, *args, **kwargs):
         self.logger.debug('run')
         self.start(*args, **kwargs)
-        self.logger.debug('started, add iterable')
-        self.extend(iterable)
-        self.logger.debug('waiting to finish')
-        self.wait()
-        result = self.result
-        self.result = None
+        try:
+            self.logger.debug('started, add iterable')
+            self.extend(iterable)
+            self.logger.debug('waiting to finish')
+            self.wait()
+        finally:
+            result = self._finish()
         self.logger.debug('Threaded run done, %d results', len(result))
         return result
 
+    def imap(self, iterable, *args, window=None, ordered=True, **kwargs):
+        """
+        Like run_with_iter, but yields the results as they come in. Items are taken lazily from the iterable: at
+        most `window` (default twice the amount of workers) items (chunks if chunksize > 1) are queued or waiting
+        to be yielded at any time. Failed items and None results are skipped, like with run.
+
+        :param ordered: bool Yield the results in the order of the iterable, otherwise as they complete
+        """
+        if window is None:
+            window = 2 * self.n_workers
+        self.start(*args, **kwargs)
+        call = self._current
+        out = Queue()
+        try:
+            for results in _windowed(_chunked(iterable, self.chunksize),
+                                     lambda index, chunk: self.q.put(([(row,) for row in chunk], out, index, call)),
+                                     out, window, ordered):
+                for result in results:
+                    if result is not None:
+                        yield result
+            self._raise_initializer_error()
+        finally:
+            # tasks still queued when the generator is closed early are skipped by the workers
+            call.cancelled = True
+            self._finish()
+        self.logger.debug('Threaded imap done')
+
+    def imap_unordered(self, iterable, *args, window=None, **kwargs):
+        return self.imap(iterable, *args, window=window, ordered=False, **kwargs)
+
     def run(self, *args, **kwargs) -> list:
         self.logger.debug('run')
         self.start(*args, **kwargs)
         self.logger.debug('started, waiting now')
-        self.wait()
-        result = self.result
-        self.result = None
+        try:
+            self.wait()
+        finally:
+            result = self._finish()
         self.logger.debug('Threaded run done, %d results', len(result))
         return result
 
 
-def singlethreaded(*args, pass_thread_id=True, class_method_with_self=False, pre_start=False, pbar=None, **kwargs):
+def _synchronous(func):
+    """
+    Coroutine functions are run to completion on an event loop of their own, so (single/multi)threaded can be used
+    as drop-in for async_mapped
+    """
+    if not asyncio.iscoroutinefunction(func):
+        return func
+
+    @wraps(func)
+    def _(*args, **kwargs):
+        return asyncio.run(func(*args, **kwargs))
+    return _
+
+
+def singlethreaded(*args, pass_thread_id=True, class_method_with_self=False, pre_start=False, pbar=None,
+                   initializer=None, initargs=(), finalizer=None, checkpoint=None, **kwargs):
     """
     To easily disable the multithreading, and just run sequentially (just replace @multithreaded with @singlethreaded)
     >>> from collections import namedtuple
@@ -224,17 +760,27 @@ def singlethreaded(*args, pass_thread_id=True, class_method_with_self=False, pre
     True
     >>> all(k['thread_id'] in [0, 1] for a, k in res)
     True
+    >>> [a for a, k in refl.imap(range(3), 'test')]
+    [('test', 0), ('test', 1), ('test', 2)]
     """
     del args, kwargs
 
     def _decorator(func):
-        def _(alist, *args, **kwargs):
+        processor = _synchronous(func)
+
+        def _iter(alist, args, kwargs):
             args = list(args)
             if class_method_with_self:
                 args[0], alist = alist, args[0]
+            if initializer is not None:
+                kwargs['resource'] = initializer(*initargs)
+            try:
+                yield from _process(alist, args, kwargs)
+            finally:
+                if finalizer is not None:
+                    finalizer(kwargs.get('resource'))
 
-            results = []
-
+        def _process(alist, args, kwargs):
             for arow in alist:
                 try:
                     if class_method_with_self:
@@ -244,15 +790,27 @@ def singlethreaded(*args, pass_thread_id=True, class_method_with_self=False, pre
                     nargs = list(nargs)
                     if pass_thread_id:
                         kwargs['thread_id'] = 0
-                    res = func(*nargs, **kwargs)
-                    if res is not None:
-                        results.append(res)
+                    if checkpoint is not None:
+                        res = checkpoint.process(processor, nargs, kwargs, key=checkpoint.key(arow))
+                    else:
+                        res = processor(*nargs, **kwargs)
                 except Exception as e:
                     logger.exception(e)
+                    res = None
                 finally:
                     if pbar:
                         pbar.update(1)
-            return results
+                if res is not None:
+                    yield res
+
+        def _(alist, *args, **kwargs):
+            return list(_iter(alist, args, kwargs))
+
+        def imap(alist, *args, ordered=True, window=None, **kwargs):
+            return _iter(alist, args, kwargs)
+
+        _.imap = imap
+        _.imap_unordered = imap
         _._multithread = Null
         return _
 
@@ -319,6 +877,8 @@ def multithreaded(*args, class_method_with_self=False, pre_start=False, **kwargs
     True
     >>> all(k['thread_id'] in [0, 1] for a, k in res)
     True
+    >>> [a for a, k in refl.imap(range(3), 'test')]
+    [('test', 0), ('test', 1), ('test', 2)]
     """
 
     # Add 'None' processor
@@ -326,11 +886,15 @@ def multithreaded(*args, class_method_with_self=False, pre_start=False, **kwargs
     a.extend(args)
     args = a
 
-    mt = MultiThread(*args, **kwargs)
-    del args, kwargs
+    return _pool_decorator(MultiThread(*args, **kwargs), class_method_with_self, pre_start)
 
+
+def _pool_decorator(mt, class_method_with_self, pre_start):
     def _decorator(func):
-        mt.processor = func
+        if isinstance(mt, MultiProcess):
+            mt.processor = _DecoratedFunction(func)
+        else:
+            mt.processor = _synchronous(func)
 
         def _(alist, *args, **kwargs):
             if class_method_with_self:
@@ -341,6 +905,15 @@ def multithreaded(*args, class_method_with_self=False, pre_start=False, **kwargs
                 return mt.run(*args, **kwargs)
             return mt.run_with_iter(alist, *args, **kwargs)
 
+        def imap(alist, *args, **kwargs):
+            if class_method_with_self:
+                args = list(args)
+                args[0], alist = alist, args[0]
+            return mt.imap(alist, *args, **kwargs)
+
+        _.imap = imap
+        _.imap_unordered = partial(imap, ordered=False)
+        _.__wrapped__ = func
         _._multithread = mt
         return _
 
@@ -349,6 +922,537 @@ def multithreaded(*args, class_method_with_self=False, pre_start=False, **kwargs
 
 multithreadedmethod = partial(multithreaded, class_method_with_self=True)
 
+_process_worker = {}
+
+
+class _DecoratedFunction:
+    """
+    Processor of @multiprocessed. The module level name of the function refers to the decorator's wrapper, so it
+    can't be pickled as is (for the 'spawn' and 'forkserver' start methods): it's pickled by module and qualname,
+    the worker resolves that to the wrapper and takes the function from its __wrapped__.
+    """
+    def __init__(self, func):
+        self.module = func.__module__
+        self.qualname = func.__qualname__
+        self._func = _synchronous(func)
+
+    def __getstate__(self):
+        if '<locals>' in self.qualname:
+            raise pickle.PicklingError("Can't pickle %s: @multiprocessed functions need to be defined at module "
+                                       "(or class) level, unless the workers are forked" % self.qualname)
+        return {'module': self.module, 'qualname': self.qualname}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._func = None
+
+    def __call__(self, *args, **kwargs):
+        if self._func is None:
+            obj = importlib.import_module(self.module)
+            for name in self.qualname.split('.'):
+                obj = getattr(obj, name)
+            self._func = _synchronous(getattr(obj, '__wrapped__', obj))
+        return self._func(*args, **kwargs)
+
+
+def _init_process_worker(counter, processor, pass_thread_id, initializer, initargs, finalizer):
+    with counter.get_lock():
+        thread_id = counter.value
+        counter.value += 1
+    _process_worker.update(processor=processor, thread_id=thread_id, pass_thread_id=pass_thread_id)
+    if initializer is not None:
+        try:
+            resource = initializer(*initargs)
+        except Exception as e:
+            # raising would make the pool respawn the worker forever, the run raises it instead (see MultiThread)
+            logger.exception(e)
+            _process_worker['error'] = e
+            return
+        _process_worker['resource'] = resource
+        if finalizer is not None:
+            multiprocessing.util.Finalize(None, finalizer, args=(resource,), exitpriority=10)
+
+
+def _process_chunk(args, kwargs, rows):
+    """
+    :return: tuple Results, amount of errors and the exception of a failed initializer (or None)
+    """
+    if 'error' in _process_worker:
+        return [None] * len(rows), len(rows), _process_worker['error']
+    processor = _process_worker['processor']
+    if _process_worker['pass_thread_id']:
+        kwargs = dict(kwargs, thread_id=_process_worker['thread_id'])
+    if 'resource' in _process_worker:
+        kwargs = dict(kwargs, resource=_process_worker['resource'])
+    results = []
+    errors = 0
+    for row in rows:
+        result = None
+        try:
+            result = processor(*args, *row, **kwargs)
+        except Exception as e:
+            errors += 1
+            logger.exception(e)
+        results.append(result)
+    return results, errors, None
+
+
+class MultiProcess:
+    """
+    Process pool version of MultiThread for CPU bound work, with the same API. Items are dispatched in chunks of
+    `chunksize`, `thread_id` is the index of the worker process. The pool is started on the first run, the
+    processor is handed to every worker once (it, and the items and results, need to be picklable with the
+    'spawn' or 'forkserver' start methods; for @multiprocessed that means defined at module or class level).
+
+    :param initializer: callable Called with `initargs` in every worker process when it starts, what it returns is
+                        passed to the processor as the `resource` kwarg. If it fails the worker fails its items and
+                        the run raises the exception.
+    :param finalizer: callable Called with the resource when a worker process exits
+
+    >>> def square(n, thread_id, offset=0):
+    ...     return thread_id, n * n + offset
+    >>> with MultiProcess(square, n_workers=2, chunksize=5) as p:
+    ...     p.extend(range(20))
+    ...     res = p.run(offset=1)
+    ...     print(sorted(r for _, r in res) == [n * n + 1 for n in range(20)], {t for t, _ in res} <= {0, 1})
+    ...     print([r for _, r in p.imap(range(5), window=1)])
+    True True
+    [0, 1, 4, 9, 16]
+    >>> p.running
+    False
+    >>> with MultiProcess(square, n_workers=2, initializer=int, initargs=('x',)) as p:
+    ...     p.extend(range(4))
+    ...     p.run()
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid literal for int() with base 10: 'x'
+    >>> p.errors, p.running
+    (4, False)
+    """
+    def __init__(self, processor=None, n_workers=None, pbar=None, pass_thread_id=True, chunksize=1,
+                 initializer=None, initargs=(), finalizer=None, context=None):
+        self.processor = processor
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.pbar = pbar
+        self.pass_thread_id = pass_thread_id
+        self.chunksize = chunksize
+        self.initializer = initializer
+        self.initargs = initargs
+        self.finalizer = finalizer
+        self.context = multiprocessing.get_context(context)
+        self.logger = logger
+        self.result = None
+        self.errors = 0
+        self._rows = []
+        self._pool = None
+        self._pool_lock = Lock()
+
+    def _ensure_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                counter = self.context.Value('i', 0)
+                self._pool = self.context.Pool(self.n_workers, initializer=_init_process_worker,
+                                               initargs=(counter, self.processor, self.pass_thread_id,
+                                                         self.initializer, self.initargs, self.finalizer))
+            return self._pool
+
+    def shutdown(self, wait=True):
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            if wait:
+                pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def append(self, *args):
+        self._rows.append(args)
+
+    def extend(self, iterable):
+        for row in iterable:
+            self.append(row)
+
+    @property
+    def running(self):
+        return self.result is not None
+
+    def _imap_rows(self, rows, args, kwargs, window, ordered):
+        if self.running:
+            raise AlreadyRunningError("Attempted to run while already running")
+        if window is None:
+            window = 2 * self.n_workers
+        pool = self._ensure_pool()
+        self.result = []
+        out = Queue()
+
+        def submit(index, chunk):
+            pool.apply_async(_process_chunk, (args, kwargs, chunk),
+                             callback=lambda res: out.put((index, (len(chunk), res, None))),
+                             error_callback=lambda e: out.put((index, (len(chunk), ([], len(chunk), None), e))))
+
+        initializer_error = None
+        try:
+            for count, (results, errors, failed), exception in _windowed(_chunked(rows, self.chunksize), submit,
+                                                                         out, window, ordered):
+                if self.pbar is not None:
+                    self.pbar.update(count)
+                if exception is not None:
+                    self.logger.exception(exception)
+                if initializer_error is None:
+                    initializer_error = failed
+                self.errors += errors
+                for result in results:
+                    if result is not None:
+                        yield result
+            if initializer_error is not None:
+                # the next run starts new workers, with new initializer calls
+                self.shutdown()
+                raise initializer_error
+        finally:
+            self.result = None
+
+    def imap(self, iterable, *args, window=None, ordered=True, **kwargs):
+        """
+        See MultiThread.imap, `window` is in chunks
+        """
+        return self._imap_rows(((row,) for row in iterable), args, kwargs, window, ordered)
+
+    def imap_unordered(self, iterable, *args, window=None, **kwargs):
+        return self.imap(iterable, *args, window=window, ordered=False, **kwargs)
+
+    def run_with_iter(self, iterable, *args, **kwargs):
+        return list(self.imap_unordered(iterable, *args, **kwargs))
+
+    def run(self, *args, **kwargs) -> list:
+        rows, self._rows = self._rows, []
+        result = list(self._imap_rows(rows, args, kwargs, None, False))
+        self.logger.debug('Multiprocess run done, %d results', len(result))
+        return result
+
+
+def multiprocessed(*args, class_method_with_self=False, pre_start=False, **kwargs):
+    """
+    Decorator version of MultiProcess, a drop-in for @multithreaded for CPU bound work
+
+    >>> @multiprocessed(2, chunksize=10)
+    ... def normalized(word, thread_id):
+    ...     return word.lower()
+    >>> sorted(normalized(['B', 'A', 'C'] * 10))[::10]
+    ['a', 'b', 'c']
+    >>> list(normalized.imap(['X', 'Y']))
+    ['x', 'y']
+    >>> @multiprocessed(2, pre_start=True, pass_thread_id=False, initializer=int, initargs=('2',))
+    ... def multiply(n, resource):
+    ...     return resource * n
+    >>> sorted(multiply(iter(range(5))))
+    [0, 2, 4, 6, 8]
+    >>> multiply._multithread.shutdown()
+    >>> type(normalized._multithread) is MultiProcess
+    True
+    >>> normalized._multithread.shutdown()
+    """
+    a = [None]
+    a.extend(args)
+    return _pool_decorator(MultiProcess(*a, **kwargs), class_method_with_self, pre_start)
+
+
+multiprocessedmethod = partial(multiprocessed, class_method_with_self=True)
+
+
+async def _aiter(iterable):
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+def async_mapped(concurrency=10, timeout=None, pbar=None, pass_thread_id=True, class_method_with_self=False):
+    """
+    Decorator to map a coroutine function over an (async) iterable with at most `concurrency` calls in flight.
+    Like with @multithreaded, calling the decorated function with an iterable returns the list of results (failed,
+    timed out and None results are skipped), `thread_id` is the concurrency slot (0 - concurrency-1) of the call.
+    From a running event loop use `await func.amap(...)` or `async for result in func.stream(...)`, which yields the
+    results as they complete.
+
+    :param timeout: float Seconds per item, an item taking longer is cancelled and logged
+
+    >>> @async_mapped(concurrency=3, timeout=.5)
+    ... async def fetch(n, thread_id, prefix=''):
+    ...     await asyncio.sleep(1 if n == 5 else .01)
+    ...     return thread_id, '%s%d' % (prefix, n)
+    >>> res = fetch(range(10), prefix='pid')
+    >>> sorted(r for _, r in res)
+    ['pid0', 'pid1', 'pid2', 'pid3', 'pid4', 'pid6', 'pid7', 'pid8', 'pid9']
+    >>> {t for t, _ in res} <= {0, 1, 2}
+    True
+    >>> async def numbers():
+    ...     for n in range(3):
+    ...         yield n
+    >>> async def main():
+    ...     return sorted([r async for _, r in fetch.stream(numbers())])
+    >>> asyncio.run(main())
+    ['0', '1', '2']
+    >>> async def slow_numbers():
+    ...     yield 0
+    ...     await asyncio.sleep(.5)
+    ...     yield 1
+    >>> async def first():
+    ...     start = time.monotonic()
+    ...     async for _, r in fetch.stream(slow_numbers()):
+    ...         return r, time.monotonic() - start < .3
+    >>> asyncio.run(first())
+    ('0', True)
+    >>> @multithreaded(2)
+    ... async def fetch_threaded(n, thread_id):
+    ...     await asyncio.sleep(.01)
+    ...     return n
+    >>> sorted(fetch_threaded(range(4)))
+    [0, 1, 2, 3]
+    """
+    def _decorator(func):
+        async def run_one(item, args, kwargs, thread_id, free):
+            try:
+                if class_method_with_self:
+                    nargs = [args[0], item, *args[1:]]
+                else:
+                    nargs = [*args, item]
+                if pass_thread_id:
+                    kwargs = dict(kwargs, thread_id=thread_id)
+                coroutine = func(*nargs, **kwargs)
+                if timeout is not None:
+                    return await asyncio.wait_for(coroutine, timeout)
+                return await coroutine
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                free.append(thread_id)
+                if pbar is not None:
+                    pbar.update(1)
+
+        async def stream(alist, *args, **kwargs):
+            if class_method_with_self:
+                args = list(args)
+                args[0], alist = alist, args[0]
+            free = list(range(concurrency - 1, -1, -1))
+            slots = asyncio.Semaphore(concurrency)
+            finished = asyncio.Queue()
+            pending = set()
+
+            async def feed():
+                async for item in _aiter(alist):
+                    await slots.acquire()
+                    task = asyncio.ensure_future(run_one(item, args, kwargs, free.pop(), free))
+                    pending.add(task)
+                    task.add_done_callback(finished.put_nowait)
+
+            # the items are fed in a task of their own, so results are yielded while waiting for a slow producer
+            feeder = asyncio.ensure_future(feed())
+            feeder.add_done_callback(finished.put_nowait)
+            try:
+                while not feeder.done() or pending:
+                    task = await finished.get()
+                    if task is feeder:
+                        task.result()
+                        continue
+                    pending.discard(task)
+                    slots.release()
+                    if task.result() is not None:
+                        yield task.result()
+            finally:
+                feeder.cancel()
+                for task in pending:
+                    task.cancel()
+
+        async def amap(alist, *args, **kwargs):
+            return [result async for result in stream(alist, *args, **kwargs)]
+
+        def _(alist, *args, **kwargs):
+            return asyncio.run(amap(alist, *args, **kwargs))
+
+        _.stream = stream
+        _.amap = amap
+        _._multithread = Null
+        return _
+
+    return _decorator
+
+
+async_mappedmethod = partial(async_mapped, class_method_with_self=True)
+
+
+class Batcher:
+    """
+    Coalesces single calls from multiple threads into batch calls. Callers block on a future while a dispatcher
+    thread collects calls for at most `max_wait_ms` milliseconds (or until `max_size` calls are collected) and hands
+    them to `batch_fn` in one go.
+
+    `batch_fn` receives the list of items and returns either a list of results in the same order, or a mapping of
+    item => result (missing items get None).
+
+    >>> batches = []
+    >>> def square_all(items):
+    ...     batches.append(len(items))
+    ...     return [i * i for i in items]
+    >>> batcher = Batcher(square_all, max_size=10, max_wait_ms=50)
+    >>> res = MultiThread(lambda i, **kwargs: (i, batcher(i)), n_workers=10, pass_thread_id=False)
+    >>> res.extend(range(20))
+    >>> sorted(res.run()) == [(i, i * i) for i in range(20)]
+    True
+    >>> sum(batches)
+    20
+    >>> len(batches) < 20
+    True
+    >>> Batcher(lambda items: {1: 'one'})(2) is None
+    True
+    >>> broken = Batcher(lambda items: [1], max_size=2, max_wait_ms=100)
+    >>> futures = [broken.submit(1), broken.submit(2)]
+    >>> e = futures[0].exception(timeout=5)
+    >>> type(e).__name__, str(e)
+    ('BatchError', 'Batch function returned 1 results for 2 items')
+    >>> futures[1].exception(timeout=5) is futures[0].exception()
+    True
+    >>> broken._thread.is_alive(), Batcher(lambda items: items)(3)
+    (True, 3)
+    """
+    def __init__(self, batch_fn, max_size=50, max_wait_ms=10, class_method_with_self=False):
+        self.batch_fn = batch_fn
+        self.max_size = max_size
+        self.max_wait = max_wait_ms / 1000
+        self.class_method_with_self = class_method_with_self
+        self.q = Queue()
+        self.logger = logger
+        self._thread = None
+        self._lock = Lock()
+
+    def submit(self, *args) -> Future:
+        """
+        Queue a single call, with class_method_with_self args should be (self, item) otherwise just (item,)
+        """
+        self._ensure_dispatcher()
+        future = Future()
+        self.q.put((args, future))
+        return future
+
+    def __call__(self, *args):
+        return self.submit(*args).result()
+
+    def _ensure_dispatcher(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._dispatcher, daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self.q.get()]
+        until = time.monotonic() + self.max_wait
+        while len(batch) < self.max_size:
+            remaining = until - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.q.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _dispatcher(self):
+        while True:
+            batch = self._collect()
+            groups = OrderedDict()
+            for args, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                owner = args[0] if self.class_method_with_self else None
+                groups.setdefault(id(owner), (owner, []))[1].append((args[-1], future))
+
+            for owner, calls in groups.values():
+                try:
+                    self._run_batch(owner, calls)
+                except BaseException as e:
+                    # never let a batch take the dispatcher down, the callers would wait forever
+                    self.logger.exception(e)
+                    for _, future in calls:
+                        if not future.done():
+                            future.set_exception(e)
+
+    def _run_batch(self, owner, calls):
+        items = [item for item, _ in calls]
+        try:
+            if self.class_method_with_self:
+                results = self.batch_fn(owner, items)
+            else:
+                results = self.batch_fn(items)
+            if isinstance(results, Mapping):
+                results = [results.get(item) for item in items]
+            else:
+                results = list(results)
+            if len(results) != len(items):
+                raise BatchError("Batch function returned %d results for %d items" % (len(results), len(items)))
+        except BaseException as e:
+            self.logger.debug('Batch of %d failed: %s', len(items), e)
+            for _, future in calls:
+                future.set_exception(e)
+            return
+
+        for (_, future), result in zip(calls, results):
+            future.set_result(result)
+
+
+def batched(max_size=50, max_wait_ms=10, batch_fn=None, class_method_with_self=False):
+    """
+    Decorator that turns concurrent single-item calls into batch calls (see Batcher). The decorated function keeps
+    its single-item signature. Without `batch_fn` the decorated function itself is the batch function (it receives
+    a list of items).
+
+    >>> calls = []
+    >>> def lookup_many(keys):
+    ...     calls.append(sorted(keys))
+    ...     return {k: k.upper() for k in keys}
+    >>> @batched(max_size=3, max_wait_ms=100, batch_fn=lookup_many)
+    ... def lookup(key):
+    ...     return key.upper()
+    >>> @multithreaded(3, pass_thread_id=False)
+    ... def lookup_all(key):
+    ...     return lookup(key)
+    >>> sorted(lookup_all(['a', 'b', 'c']))
+    ['A', 'B', 'C']
+    >>> calls
+    [['a', 'b', 'c']]
+    >>> type(lookup._batcher) is Batcher
+    True
+    >>> class A:
+    ...     def __init__(self, name):
+    ...         self.name = name
+    ...     def many(self, items):
+    ...         return ['%s%d' % (self.name, i) for i in items]
+    ...     @batched(batch_fn=many, class_method_with_self=True)
+    ...     def one(self, item):
+    ...         pass
+    >>> A('a').one(1), A('b').one(2)
+    ('a1', 'b2')
+    """
+    def _decorator(func):
+        batcher = Batcher(func if batch_fn is None else batch_fn, max_size=max_size, max_wait_ms=max_wait_ms,
+                          class_method_with_self=class_method_with_self)
+
+        @wraps(func)
+        def _(*args):
+            return batcher(*args)
+
+        _._batcher = batcher
+        return _
+
+    return _decorator
+
 
 class __ExtraTests:
     """
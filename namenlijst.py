@@ -1,11 +1,11 @@
-from jsonrpc_requests import Server, ProtocolError
+from jsonrpc_requests import Server, ProtocolError, TransportError
 from .config import Config
 
 import logging
 import http.client as http_client
 from urllib.parse import urlparse
 import datetime
-from .decorators import retry, classcache
+from .decorators import retry, classcache, circuit_breaker
 from .cache import OptimizedFileCacher
 from .ner import normalize
 from collections import namedtuple, defaultdict
@@ -417,6 +417,7 @@ class Method:
                 kwargs['token'] = self.__obj.refresh_token()
                 self.__token = kwargs['token']
 
+    @circuit_breaker('namenlijst', exceptions=TransportError)
     def __call__(self, *args, **kwargs):
         logger.debug("NMLD call %s with args(%s, %s)", self.__method_name, args, kwargs)
         kwargs = dict(kwargs, token=self.__token)
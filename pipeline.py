@@ -0,0 +1,212 @@
+import time
+from queue import Queue, Empty, Full
+from threading import Thread, Lock
+from .multithreading import MultiThread, MultiProcess
+
+import logging
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class PipelineStopped(Exception):
+    pass
+
+
+class Stage:
+    """
+    One step of a Pipeline: `processor` is called with every item of the previous stage (by a MultiThread, or a
+    MultiProcess with processes=True) and what it returns goes to the next stage, None drops the item.
+
+    :param n_workers: int Threads (or processes) of this stage
+    :param queue_size: int Maximum amount of items waiting for this stage, defaults to the one of the Pipeline
+    :param kwargs: Passed to the MultiThread/MultiProcess, eg. pass_thread_id, initializer, chunksize
+    """
+    def __init__(self, processor, n_workers=1, processes=False, queue_size=None, name=None, **kwargs):
+        self.name = name or getattr(processor, '__name__', 'stage')
+        self.n_workers = n_workers
+        self.queue_size = queue_size
+        self.pool = (MultiProcess if processes else MultiThread)(processor, n_workers=n_workers, **kwargs)
+        self.q = None
+        self.reset()
+
+    def reset(self):
+        self.processed = 0
+        self.produced = 0
+        self._errors = self.pool.errors
+
+    @property
+    def errors(self) -> int:
+        return self.pool.errors - self._errors
+
+    def stats(self, elapsed) -> dict:
+        return {
+            'name': self.name,
+            'workers': self.n_workers,
+            'processed': self.processed,
+            'produced': self.produced,
+            'errors': self.errors,
+            'throughput': self.processed / elapsed if elapsed else None,
+            'queue': self.q.qsize() if self.q is not None else 0,
+        }
+
+
+class Pipeline:
+    """
+    Chain of stages, every stage has its own workers and takes its items from a bounded queue filled by the
+    previous one. A slow stage fills its queue and so blocks the stages before it: the slowest stage sets the pace
+    and the amount of items in flight stays bounded.
+
+    >>> def resolve(pid, **kwargs):
+    ...     return pid.upper()
+    >>> def fetch(pid, **kwargs):
+    ...     time.sleep(.01)
+    ...     if pid == 'P3':
+    ...         raise ValueError('no metadata for %s' % pid)
+    ...     return pid, len(pid)
+    >>> def render(item, **kwargs):
+    ...     return '%s:%d' % item
+    >>> with Pipeline(Stage(resolve), Stage(fetch, n_workers=4), Stage(render, n_workers=2), queue_size=5) as p:
+    ...     results = sorted(p.run('p%d' % i for i in range(20)))
+    ...     stats = p.stats()
+    >>> len(results), results[:3]
+    (19, ['P0:2', 'P10:3', 'P11:3'])
+    >>> [(s['name'], s['processed'], s['produced'], s['errors']) for s in stats]
+    [('resolve', 20, 20, 0), ('fetch', 20, 19, 1), ('render', 19, 19, 0)]
+    >>> sorted(stats[0])
+    ['errors', 'name', 'processed', 'produced', 'queue', 'throughput', 'workers']
+    """
+    def __init__(self, *stages, queue_size=100):
+        """
+        :param stages: Stage|callable Callables become single worker thread stages
+        :param queue_size: int Default maximum queue size in front of every stage
+        """
+        self.stages = [stage if isinstance(stage, Stage) else Stage(stage) for stage in stages]
+        self.queue_size = queue_size
+        self.logger = logger
+        self._start = None
+        self._end = None
+        self._stop = False
+        self._exception = None
+        self._lock = Lock()
+
+    def _put(self, q, item):
+        while not self._stop:
+            try:
+                q.put(item, timeout=.1)
+                return
+            except Full:
+                pass
+        raise PipelineStopped()
+
+    def _items(self, stage):
+        while True:
+            try:
+                item = stage.q.get(timeout=.1)
+            except Empty:
+                if self._stop:
+                    return
+                continue
+            if item is _END:
+                return
+            stage.processed += 1
+            yield item
+
+    def _feed(self, iterable, q):
+        try:
+            for item in iterable:
+                self._put(q, item)
+        except PipelineStopped:
+            return
+        except BaseException as e:
+            self._fail(e)
+        self._put_end(q)
+
+    def _run_stage(self, stage, out):
+        try:
+            for result in stage.pool.imap_unordered(self._items(stage)):
+                stage.produced += 1
+                self._put(out, result)
+        except PipelineStopped:
+            return
+        except BaseException as e:
+            self._fail(e)
+        self._put_end(out)
+
+    def _put_end(self, q):
+        try:
+            self._put(q, _END)
+        except PipelineStopped:
+            pass
+
+    def _fail(self, e):
+        with self._lock:
+            if self._exception is None:
+                self._exception = e
+        self._stop = True
+
+    def run(self, iterable):
+        """
+        Push the items of iterable through all stages
+        :return: generator Results of the last stage, in order of completion
+        """
+        self._stop = False
+        self._exception = None
+        for stage in self.stages:
+            stage.q = Queue(maxsize=stage.queue_size or self.queue_size)
+            stage.reset()
+        out = Queue(maxsize=self.queue_size)
+        threads = [Thread(target=self._feed, args=(iterable, self.stages[0].q), daemon=True)]
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            threads.append(Thread(target=self._run_stage, args=(stage, next_stage.q), daemon=True))
+        threads.append(Thread(target=self._run_stage, args=(self.stages[-1], out), daemon=True))
+
+        self._start = time.monotonic()
+        self._end = None
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                try:
+                    result = out.get(timeout=.1)
+                except Empty:
+                    if self._stop:
+                        break
+                    continue
+                if result is _END:
+                    break
+                yield result
+        finally:
+            self._stop = True
+            for thread in threads:
+                thread.join()
+            self._end = time.monotonic()
+        if self._exception is not None:
+            raise self._exception
+
+    def stats(self) -> list:
+        """
+        Per stage: amount of items processed and produced, errors, throughput (items processed per second) and the
+        amount of items waiting in its queue
+        """
+        if self._start is None:
+            elapsed = None
+        else:
+            elapsed = (self._end or time.monotonic()) - self._start
+        return [stage.stats(elapsed) for stage in self.stages]
+
+    def shutdown(self):
+        for stage in self.stages:
+            stage.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+
+if __name__ == "__main__":
+    # run with `python3 -m pythonmodules.pipeline` from parent directory
+    import doctest
+    doctest.testmod()
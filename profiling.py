@@ -1,5 +1,13 @@
 import logging
 import time
+import math
+import json
+import random
+import reprlib
+from bisect import bisect_left
+from collections import deque
+from functools import wraps
+from threading import Lock
 
 
 class timeit:
@@ -55,3 +63,236 @@ class timeit:
             self.logger.info(text + ': %dms', ms)
         elif is_slow:
             self.logger.warning(text + ': %dms', ms)
+
+
+class LatencyHistogram:
+    """Fixed-size histogram of durations in milliseconds with geometrically growing buckets (each bucket is
+    `factor` times wider than the previous one), so percentiles stay within a few percent of the real value
+    while memory stays constant.
+
+    >>> h = LatencyHistogram()
+    >>> for ms in range(1, 101):
+    ...     h.add(ms)
+    >>> h.count
+    100
+    >>> 48 <= h.percentile(50) <= 53
+    True
+    >>> 94 <= h.percentile(95) <= 100
+    True
+    >>> h.percentile(100) == h.max == 100
+    True
+    >>> LatencyHistogram().percentile(50) is None
+    True
+    """
+    def __init__(self, min_ms=.001, max_ms=3600000, factor=1.05):
+        self.bounds = []
+        bound = min_ms
+        while bound < max_ms:
+            self.bounds.append(bound)
+            bound *= factor
+        self.bounds.append(math.inf)
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.total = 0.
+        self.max = None
+
+    def add(self, ms):
+        self.counts[bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if self.max is None or ms > self.max:
+            self.max = ms
+
+    def percentile(self, p):
+        """
+        :param p: float Percentile (0-100)
+        :return: float|None Upper bound of the bucket holding the percentile, in ms
+        """
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class FunctionTrace:
+    """Call counts, latencies and slow call samples of one traced function"""
+    def __init__(self, name, max_slow_calls=10):
+        self.name = name
+        self.calls = 0
+        self.sampled = 0
+        self.errors = 0
+        self.histogram = LatencyHistogram()
+        self.slow_calls = deque(maxlen=max_slow_calls)
+        self._lock = Lock()
+
+    def count_call(self):
+        with self._lock:
+            self.calls += 1
+
+    def record(self, ms, failed, args=None):
+        with self._lock:
+            self.sampled += 1
+            if failed:
+                self.errors += 1
+            self.histogram.add(ms)
+            if args is not None:
+                self.slow_calls.append((ms, args))
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            h = self.histogram
+            return {
+                'calls': self.calls,
+                'sampled': self.sampled,
+                'errors': self.errors,
+                'mean_ms': h.total / h.count if h.count else None,
+                'p50_ms': h.percentile(50),
+                'p95_ms': h.percentile(95),
+                'p99_ms': h.percentile(99),
+                'max_ms': h.max,
+                'slow_calls': [{'ms': ms, 'args': args} for ms, args in self.slow_calls],
+            }
+
+
+class TraceRegistry:
+    """Holds the traces of all functions decorated with @trace, disabled by default.
+
+        registry.enable(sample_rate=.01, slow_ms=500)
+        ...
+        print(registry.to_json())
+    """
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.
+        self.slow_ms = None
+        self.max_slow_calls = 10
+        self.traces = {}
+        self._lock = Lock()
+        self._repr = reprlib.Repr()
+        self._repr.maxstring = 80
+        self._repr.maxother = 80
+
+    def enable(self, sample_rate=1., slow_ms=None, max_slow_calls=None):
+        """
+        :param sample_rate: float Fraction of the calls to time
+        :param slow_ms: float Capture the arguments of sampled calls taking longer than this
+        :param max_slow_calls: int Amount of slow calls to keep per function
+        """
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        if max_slow_calls is not None:
+            self.max_slow_calls = max_slow_calls
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.traces = {}
+
+    def get(self, name) -> FunctionTrace:
+        try:
+            return self.traces[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self.traces:
+                self.traces[name] = FunctionTrace(name, self.max_slow_calls)
+            return self.traces[name]
+
+    def format_args(self, args, kwargs):
+        parts = [self._repr.repr(a) for a in args[:10]]
+        parts.extend('%s=%s' % (k, self._repr.repr(v)) for k, v in list(kwargs.items())[:10])
+        return ', '.join(parts)
+
+    def dump(self) -> dict:
+        return {name: trace.as_dict() for name, trace in list(self.traces.items())}
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.dump(), **kwargs)
+
+
+registry = TraceRegistry()
+
+
+def trace(func=None, name=None, trace_registry=None):
+    """Decorator to record call counts and (sampled) latencies in a TraceRegistry. When tracing is disabled the
+    only overhead is one attribute lookup.
+
+    >>> reg = TraceRegistry()
+    >>> @trace(trace_registry=reg)
+    ... def work(n, fail=False):
+    ...     time.sleep(n / 1000)
+    ...     if fail:
+    ...         raise ValueError(n)
+    ...     return n
+    >>> work(1)
+    1
+    >>> reg.dump()
+    {}
+    >>> reg.enable(slow_ms=5)
+    >>> [work(n) for n in (1, 1, 10)]
+    [1, 1, 10]
+    >>> work(1, fail=True)
+    Traceback (most recent call last):
+    ...
+    ValueError: 1
+    >>> stats = reg.dump()['work']
+    >>> stats['calls'], stats['sampled'], stats['errors']
+    (4, 4, 1)
+    >>> stats['p50_ms'] >= 1, stats['p99_ms'] >= 10
+    (True, True)
+    >>> [call['args'] for call in stats['slow_calls']]
+    ['10']
+    >>> reg.enable(sample_rate=0)
+    >>> work(1), reg.dump()['work']['calls'], reg.dump()['work']['sampled']
+    (1, 5, 4)
+    >>> reg.reset()
+    >>> reg.dump()
+    {}
+    >>> work(1), reg.dump()['work']['calls']
+    (1, 1)
+    """
+    def _decorator(func):
+        reg = registry if trace_registry is None else trace_registry
+        trace_name = func.__qualname__ if name is None else name
+
+        @wraps(func)
+        def _(*args, **kwargs):
+            if not reg.enabled:
+                return func(*args, **kwargs)
+
+            # looked up on every call, so the trace of a reset registry is recreated
+            ft = reg.get(trace_name)
+            ft.count_call()
+            if reg.sample_rate < 1 and random.random() >= reg.sample_rate:
+                return func(*args, **kwargs)
+
+            failed = True
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                ms = (time.perf_counter() - start) * 1000
+                slow = reg.slow_ms is not None and ms >= reg.slow_ms
+                ft.record(ms, failed, reg.format_args(args, kwargs) if slow else None)
+
+        return _
+
+    if func is not None:
+        return _decorator(func)
+    return _decorator
+
+
+if __name__ == '__main__':
+    # run with `python3 -m pythonmodules.profiling` from parent directory
+    import doctest
+    doctest.testmod()